@@ -1,131 +1,1621 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
 import os
-from typing import List
+import threading
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, \
+    Tuple
 
+import psycopg2
+import pydantic
 import yaml
-from fastapi import FastAPI, Response, HTTPException
+from psycopg2.errorcodes import UNIQUE_VIOLATION
+from fastapi import FastAPI, Query, Request, Response, HTTPException
 from fastapi.encoders import jsonable_encoder
 from fastapi.params import Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy import and_
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import any_, bindparam, text, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ompid.allocation import IdBlockAllocator
+from ompid.cache import LRUCache, NegativeLookupFilter, Snapshot, key_digest
+from ompid.coalescer import WriteCoalescer
+from ompid.journal import WriteBehindJournal
 from ompid.models import Base, TopioUser, TopioUserCreate, TopioUserORM, \
     TopioAssetType, TopioAssetTypeORM, TopioAsset, TopioAssetORM, \
-    TopioAssetCreate, TopioUserQuery
+    TopioAssetCreate, TopioUserQuery, TOPIO_ASSET_ID_SEQUENCE, build_topio_id, \
+    topio_id_to_candidate_parts, TopioAssetKey
+
+logger = logging.getLogger(__name__)
 
 
 def load_default_configuration():
     with open(os.path.join(os.getcwd(), 'settings.yml')) as yaml_file:
         cfg = yaml.safe_load(yaml_file)
 
-    return cfg
+    return cfg
+
+
+async def get_db():
+    from ompid.db import SessionLocal
+    db = SessionLocal()
+
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_read_db():
+    """
+    Like get_db but for read-only endpoints: the session connects to one of
+    the configured read replicas on first use, or to the primary if none is
+    available.
+    """
+    from ompid.db import replica_router
+    db = replica_router.session()
+
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+DEFAULT_RESOLUTION_CACHE_SIZE = 100000
+DEFAULT_USER_CACHE_SIZE = 100000
+USER_CACHE_WARMING_CHUNK_SIZE = 10000
+DEFAULT_NEGATIVE_LOOKUP_FILTER_CAPACITY = 10000000
+DEFAULT_NEGATIVE_LOOKUP_FILTER_ERROR_RATE = 0.01
+NEGATIVE_LOOKUP_FILTER_REBUILD_CHUNK_SIZE = 10000
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+NDJSON_CHUNK_SIZE = 1000
+
+# user and asset IDs are INTEGER columns, so no row has an ID out of this range
+MIN_ID = -2 ** 31
+MAX_ID = 2 ** 31 - 1
+
+MAX_PAGE_SIZE = 10000
+MAX_BULK_REGISTRATION_SIZE = 50000
+IMPORT_CHUNK_SIZE = 10000
+NEXT_PAGE_CURSOR_HEADER = 'X-Next-Cursor'
+
+# the columns of TopioAsset, selected directly instead of loading ORM entities
+ASSET_COLUMNS = (
+    TopioAssetORM.local_id,
+    TopioAssetORM.owner_id,
+    TopioAssetORM.asset_type,
+    TopioAssetORM.description,
+    TopioAssetORM.id,
+    TopioAssetORM.topio_id,
+)
+
+# fields which can be selected via the `fields` parameter; owner_namespace is
+# not part of TopioAsset and only selected on request as it requires joining
+# topio_user
+ASSET_FIELDS = {column.key: column for column in ASSET_COLUMNS}
+ASSET_FIELDS['owner_namespace'] = \
+    TopioAssetORM.owner_namespace.label('owner_namespace')
+
+# PostgreSQL rejects notification payloads of 8000 bytes or more, so at most
+# 200 hex-encoded 16 byte key digests (plus separators) are sent per
+# notification
+ASSET_REGISTRATION_DIGESTS_PER_NOTIFICATION = 200
+ASSET_REGISTRATIONS_CHANNEL = 'ompid_asset_registrations'
+
+DEFAULT_WRITE_COALESCING_WINDOW_MS = 2
+DEFAULT_WRITE_COALESCING_MAX_BATCH_SIZE = 500
+
+DEFAULT_WRITE_BEHIND_DIRECTORY = 'journal'
+DEFAULT_WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+
+ASSET_TYPES_CHANNEL = 'ompid_asset_types'
+DEFAULT_ASSET_TYPES_SNAPSHOT_MAX_AGE = 300
+
+# Positive resolution results never change, so they may be cached forever.
+# Negative results only hold until the respective registration happens.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_NOT_FOUND_MAX_AGE = 60
+not_found_max_age = DEFAULT_NOT_FOUND_MAX_AGE
+
+# Topio IDs are immutable once minted, so resolution results can be cached
+# without invalidation. Forward: (owner ID, asset type, local ID) -> topio ID,
+# reverse: topio ID -> local ID. Only assets with a local ID are cached.
+topio_id_cache = LRUCache(DEFAULT_RESOLUTION_CACHE_SIZE)
+local_id_cache = LRUCache(DEFAULT_RESOLUTION_CACHE_SIZE)
+
+# Users can't be changed after registration either: user ID -> TopioUser and
+# user namespace -> user ID
+users_cache = LRUCache(DEFAULT_USER_CACHE_SIZE)
+user_ids_cache = LRUCache(DEFAULT_USER_CACHE_SIZE)
+
+# Answers lookups of (owner ID, asset type, local ID) keys that were never
+# registered without querying the database. Opt-in; once enabled, the
+# registrations of all worker processes are announced on
+# ASSET_REGISTRATIONS_CHANNEL to keep the filter of each process up to date.
+registered_assets_filter = NegativeLookupFilter(
+    DEFAULT_NEGATIVE_LOOKUP_FILTER_CAPACITY,
+    DEFAULT_NEGATIVE_LOOKUP_FILTER_ERROR_RATE)
+
+# Asset types change very rarely, so they are served from a snapshot holding
+# the pre-serialized responses. Registrations of asset types in any worker
+# process invalidate it via notifications on ASSET_TYPES_CHANNEL.
+asset_types_snapshot = Snapshot(DEFAULT_ASSET_TYPES_SNAPSHOT_MAX_AGE)
+
+# Asset IDs are part of topio IDs, so IDs are allocated up front for
+# registrations which build topio IDs before inserting the assets. Blocks of
+# IDs are only drawn in advance if a block size is configured.
+asset_id_allocator = IdBlockAllocator(TOPIO_ASSET_ID_SEQUENCE)
+
+# Opt-in; if set up on application startup, concurrent asset registrations
+# are written in batches sharing one transaction
+asset_registration_coalescer: Optional[WriteCoalescer] = None
+
+# Opt-in; if started on application startup, assets can be registered by
+# appending them to a local journal which is written to the database later
+registration_journal: Optional[WriteBehindJournal] = None
+
+# Journaled assets which are not flushed yet: (owner ID, asset type, local ID)
+# -> topio ID and topio ID -> local ID. Flushing may still drop them, so they
+# are kept out of the resolution caches and resolved with short-lived cache
+# headers only. Only assets with a local ID are tracked.
+pending_topio_ids: Dict[Tuple[int, str, str], str] = {}
+pending_local_ids: Dict[str, str] = {}
+pending_assets_lock = threading.Lock()
+
+# started on application startup if any in-process state has to be kept in
+# sync with other worker processes
+notification_listener = None
+
+
+# Register a user or an asset type, or return the one registered already
+# under the same namespace or ID. The no-op DO UPDATE makes RETURNING yield
+# the existing row on conflict; xmax is 0 only for rows inserted by the
+# statement itself.
+REGISTER_USER_QUERY = text(
+    'INSERT INTO topio_user (name, user_namespace) '
+    'VALUES (:name, :user_namespace) '
+    'ON CONFLICT (user_namespace) '
+    'DO UPDATE SET user_namespace = EXCLUDED.user_namespace '
+    'RETURNING id, name, user_namespace, (xmax = 0) AS created')
+
+REGISTER_USERS_QUERY = text(
+    'INSERT INTO topio_user (name, user_namespace) '
+    'SELECT * FROM unnest('
+    '    CAST(:names AS VARCHAR[]), '
+    '    CAST(:user_namespaces AS VARCHAR[])) '
+    'ON CONFLICT (user_namespace) '
+    'DO UPDATE SET user_namespace = EXCLUDED.user_namespace '
+    'RETURNING id, name, user_namespace, (xmax = 0) AS created')
+
+REGISTER_ASSET_TYPE_QUERY = text(
+    'INSERT INTO topio_asset_type (id, description) '
+    'VALUES (:id, :description) '
+    'ON CONFLICT (id) '
+    'DO UPDATE SET id = EXCLUDED.id '
+    'RETURNING id, description, (xmax = 0) AS created')
+
+# Registers an asset unless its (owner ID, asset type, local ID) key is taken
+# already, in which case the registered asset is returned instead. The asset
+# ID is drawn from the sequence and the topio ID is built from it and the
+# owner namespace within the statement, so registration takes a single round
+# trip. The last SELECT doesn't see the row inserted by the CTE, as both run on
+# the snapshot taken at the start of the statement, so exactly one row is
+# returned -- unless the owner is unknown, or a concurrent transaction
+# registered the key after the snapshot was taken.
+REGISTER_ASSET_QUERY = text(
+    'WITH new_asset AS ('
+    '    SELECT nextval(:sequence) AS id, user_namespace '
+    '    FROM topio_user '
+    '    WHERE id = :owner_id), '
+    'inserted AS ('
+    '    INSERT INTO topio_asset '
+    '        (id, local_id, owner_id, asset_type, description, topio_id) '
+    "    SELECT id, :local_id, :owner_id, :asset_type, :description, "
+    "        'topio.' || user_namespace || '.' || id || '.' || :asset_type "
+    '    FROM new_asset '
+    '    ON CONFLICT (owner_id, asset_type, local_id) DO NOTHING '
+    '    RETURNING id, local_id, owner_id, asset_type, description, topio_id) '
+    'SELECT *, true AS created FROM inserted '
+    'UNION ALL '
+    'SELECT id, local_id, owner_id, asset_type, description, topio_id, false '
+    'FROM topio_asset '
+    'WHERE owner_id = :owner_id '
+    'AND asset_type = :asset_type '
+    'AND local_id = :local_id')
+
+# Inserts journaled assets. Replayed journal segments may contain assets which
+# were inserted already, which are skipped like assets whose (owner ID,
+# asset type, local ID) key was registered concurrently, by another process or
+# by a concurrent request.
+INSERT_JOURNALED_ASSETS_QUERY = text(
+    'INSERT INTO topio_asset '
+    '    (id, local_id, owner_id, asset_type, description, topio_id) '
+    'SELECT * FROM unnest('
+    '    CAST(:ids AS INTEGER[]), '
+    '    CAST(:local_ids AS VARCHAR[]), '
+    '    CAST(:owner_ids AS INTEGER[]), '
+    '    CAST(:asset_types AS VARCHAR[]), '
+    '    CAST(:descriptions AS VARCHAR[]), '
+    '    CAST(:topio_ids AS VARCHAR[])) '
+    'ON CONFLICT DO NOTHING '
+    'RETURNING id, owner_id, asset_type, local_id')
+
+# Imported assets are loaded into a temporary table with COPY first, so that
+# they can be inserted with ON CONFLICT, which COPY doesn't support. The table
+# is created once per connection and emptied on every commit.
+CREATE_IMPORT_TABLE_STATEMENT = text(
+    'CREATE TEMPORARY TABLE IF NOT EXISTS import_asset '
+    '(LIKE topio_asset) ON COMMIT DELETE ROWS')
+
+IMPORT_ASSET_COLUMNS = (
+    'id', 'local_id', 'owner_id', 'asset_type', 'description', 'topio_id')
+
+INSERT_IMPORTED_ASSETS_QUERY = text(
+    f'INSERT INTO topio_asset ({", ".join(IMPORT_ASSET_COLUMNS)}) '
+    f'SELECT {", ".join(IMPORT_ASSET_COLUMNS)} FROM import_asset '
+    f'ON CONFLICT DO NOTHING '
+    f'RETURNING id')
+
+# Resolves many (owner ID, asset type, local ID) keys in one statement. The keys
+# are bound as three arrays, so the statement text does not depend on the
+# number of keys.
+RESOLVE_TOPIO_IDS_QUERY = text(
+    'SELECT a.owner_id, a.asset_type, a.local_id, a.topio_id '
+    'FROM unnest('
+    '    CAST(:owner_ids AS INTEGER[]), '
+    '    CAST(:asset_types AS VARCHAR[]), '
+    '    CAST(:local_ids AS VARCHAR[])) '
+    'AS k(owner_id, asset_type, local_id) '
+    'JOIN topio_asset a '
+    'ON a.owner_id = k.owner_id '
+    'AND a.asset_type = k.asset_type '
+    'AND a.local_id = k.local_id')
+
+
+def _etag(*resource_key) -> str:
+    """
+    Builds a strong entity tag from the parts identifying a resource whose
+    representation never changes once it exists (e.g. the parameters of a
+    successful resolution). Thus conditional requests can be answered without
+    looking up the resource.
+    """
+    digest = hashlib.sha1(json.dumps(resource_key).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+
+def _immutable_headers(etag: str) -> Dict[str, str]:
+    return {'ETag': etag, 'Cache-Control': IMMUTABLE_CACHE_CONTROL}
+
+
+def _not_found_headers() -> Dict[str, str]:
+    return {'Cache-Control': f'public, max-age={not_found_max_age}'}
+
+
+def _pending_headers() -> Dict[str, str]:
+    # resolutions of journaled assets which may still be dropped on flush are
+    # cached no longer than negative ones
+    return _not_found_headers()
+
+
+def _is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+
+    if if_none_match is None:
+        return False
+
+    # If-None-Match uses weak comparison, i.e. W/ prefixes are ignored
+    return any(
+        tag.strip().replace('W/', '', 1) == etag
+        for tag in if_none_match.split(','))
+
+
+def _not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers=_immutable_headers(etag))
+
+
+def _wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def _row_dict(row, fields: Optional[List[str]] = None) -> dict:
+    row_dict = row._asdict()
+
+    if fields is None:
+        return row_dict
+
+    return {field: row_dict[field] for field in fields}
+
+
+def _ndjson_chunks(
+        rows: Iterable,
+        chunk_size: int,
+        fields: Optional[List[str]] = None) -> Iterator[str]:
+    """
+    Serializes query result rows to newline-delimited JSON, `chunk_size` rows
+    at a time, without holding more than one chunk in memory. If `fields` are
+    given, only these are serialized.
+    """
+    lines = []
+
+    for row in rows:
+        lines.append(json.dumps(_row_dict(row, fields)))
+
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _parse_asset_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if fields is None:
+        return None
+
+    field_names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown_field_names = [
+        name for name in field_names if name not in ASSET_FIELDS]
+
+    if not field_names or unknown_field_names:
+        raise HTTPException(
+            422,
+            f'Unknown asset fields {", ".join(unknown_field_names)}; '
+            f'supported fields are {", ".join(ASSET_FIELDS)}')
+
+    return field_names
+
+
+def _encode_page_cursor(last_asset_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_asset_id).encode()).decode()
+
+
+def _decode_page_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise HTTPException(422, f'Malformed page cursor {cursor}')
+
+
+def _json_body(content) -> Tuple[bytes, str]:
+    """
+    Serializes the given content like JSONResponse does and returns the
+    resulting body along with a strong ETag derived from it.
+    """
+    body = json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(',', ':')).encode('utf-8')
+
+    return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def _json_body_response(request: Request, body: bytes, etag: str) -> Response:
+    if _is_not_modified(request, etag):
+        return Response(status_code=304, headers={'ETag': etag})
+
+    return Response(
+        content=body, media_type='application/json', headers={'ETag': etag})
+
+
+def _load_asset_types_snapshot(
+        db: Session) -> Tuple[Tuple[bytes, str], Dict[str, Tuple[bytes, str]]]:
+    """
+    Returns the serialized list of all asset types and the serialized asset
+    type for each asset type ID, each along with its ETag.
+    """
+    asset_types = [
+        TopioAssetType.from_orm(asset_type_orm)
+        for asset_type_orm in db.query(TopioAssetTypeORM).all()]
+
+    return \
+        _json_body(asset_types), \
+        {asset_type.id: _json_body(asset_type) for asset_type in asset_types}
+
+
+def _cache_user(user: TopioUser):
+    users_cache.put(user.id, user)
+    user_ids_cache.put(user.user_namespace, user.id)
+
+
+def _get_user(user_id: int, db: Session) -> Optional[TopioUser]:
+    user = users_cache.get(user_id)
+
+    if user is not None:
+        return user
+
+    topio_user_orm = \
+        db.query(TopioUserORM).filter(TopioUserORM.id == user_id).first()
+
+    if topio_user_orm is None:
+        return None
+
+    user = TopioUser.from_orm(topio_user_orm)
+    _cache_user(user)
+
+    return user
+
+
+def _get_user_namespaces(
+        user_ids: Iterable[int], db: Session) -> Dict[int, str]:
+    """
+    Returns the namespaces of the given users which are registered. All users
+    missing in the user cache are fetched with one query.
+    """
+    users = {user_id: users_cache.get(user_id) for user_id in user_ids}
+    uncached_user_ids = [
+        user_id for user_id, user in users.items() if user is None]
+
+    if uncached_user_ids:
+        topio_users_orm = db\
+            .query(TopioUserORM)\
+            .filter(TopioUserORM.id.in_(uncached_user_ids))\
+            .all()
+
+        for topio_user_orm in topio_users_orm:
+            user = TopioUser.from_orm(topio_user_orm)
+            _cache_user(user)
+            users[user.id] = user
+
+    return {
+        user_id: user.user_namespace
+        for user_id, user in users.items() if user is not None}
+
+
+def _get_user_by_namespace(
+        user_namespace: str, db: Session) -> Optional[TopioUser]:
+
+    user_id = user_ids_cache.get(user_namespace)
+
+    if user_id is not None:
+        return _get_user(user_id, db)
+
+    topio_user_orm = db\
+        .query(TopioUserORM)\
+        .filter(TopioUserORM.user_namespace == user_namespace)\
+        .first()
+
+    if topio_user_orm is None:
+        return None
+
+    user = TopioUser.from_orm(topio_user_orm)
+    _cache_user(user)
+
+    return user
+
+
+def _asset_filter_key(owner_id: int, asset_type: str, local_id: str) -> str:
+    return json.dumps([owner_id, asset_type, local_id])
+
+
+def _cache_asset(topio_id: str, owner_id: int, asset_type: str, local_id: str):
+    if local_id is None:
+        return
+
+    topio_id_cache.put((owner_id, asset_type, local_id), topio_id)
+    local_id_cache.put(topio_id, local_id)
+    registered_assets_filter.add(
+        _asset_filter_key(owner_id, asset_type, local_id))
+
+
+def _announce_registered_assets(
+        asset_keys: List[Tuple[int, str, str]], db: Session):
+    """
+    Notifies all worker processes about the registration of the given
+    (owner ID, asset type, local ID) keys once the registering transaction is
+    committed. The filter only needs the digests of the keys, so these are
+    sent instead of the keys themselves, hex-encoded and comma-separated in
+    batches of fixed size, however long the local IDs are.
+    """
+    if not registered_assets_filter.enabled:
+        return
+
+    digests = [
+        key_digest(_asset_filter_key(*asset_key)).hex()
+        for asset_key in asset_keys]
+    payloads = [
+        ','.join(digests[i:i + ASSET_REGISTRATION_DIGESTS_PER_NOTIFICATION])
+        for i in range(
+            0, len(digests), ASSET_REGISTRATION_DIGESTS_PER_NOTIFICATION)]
+
+    from ompid.db import notify
+    notify(db, ASSET_REGISTRATIONS_CHANNEL, payloads)
+
+
+def _rebuild_registered_assets_filter():
+    from ompid.db import SessionLocal
+    db = SessionLocal()
+
+    try:
+        asset_keys = db\
+            .query(
+                TopioAssetORM.owner_id,
+                TopioAssetORM.asset_type,
+                TopioAssetORM.local_id)\
+            .filter(TopioAssetORM.local_id != None)\
+            .yield_per(NEGATIVE_LOOKUP_FILTER_REBUILD_CHUNK_SIZE)
+
+        registered_assets_filter.rebuild(
+            _asset_filter_key(*asset_key) for asset_key in asset_keys)
+    finally:
+        db.close()
+
+
+def _on_asset_registrations(payload: str):
+    for digest in payload.split(','):
+        registered_assets_filter.add_digest(bytes.fromhex(digest))
+
+
+def _register_assets(topio_assets: List[TopioAssetCreate], db: Session) -> list:
+    """
+    Registers the given assets with one REGISTER_ASSET_QUERY each in one
+    transaction. Returns the registered row of each asset in the given order,
+    or None where the owner is unknown.
+    """
+    assets = []
+
+    for topio_asset in topio_assets:
+        asset_params = {
+            'sequence': TOPIO_ASSET_ID_SEQUENCE,
+            'local_id': topio_asset.local_id,
+            'owner_id': topio_asset.owner_id,
+            'asset_type': topio_asset.asset_type,
+            'description': topio_asset.description,
+        }
+
+        asset = db.execute(REGISTER_ASSET_QUERY, asset_params).first()
+
+        if asset is None:
+            # a new statement snapshot sees an asset registered concurrently
+            asset = db.execute(REGISTER_ASSET_QUERY, asset_params).first()
+
+        assets.append(asset)
+
+    _announce_registered_assets(
+        [
+            (asset.owner_id, asset.asset_type, asset.local_id)
+            for asset in assets
+            if asset is not None and asset.created
+            and asset.local_id is not None
+        ],
+        db)
+
+    db.commit()
+
+    for asset in assets:
+        if asset is not None:
+            _cache_asset(
+                asset.topio_id, asset.owner_id, asset.asset_type, asset.local_id)
+
+    return assets
+
+
+def _flush_asset_registrations(topio_assets: List[TopioAssetCreate]) -> list:
+    from ompid.db import SessionLocal
+    db = SessionLocal()
+
+    try:
+        try:
+            return _register_assets(topio_assets, db)
+        except Exception:
+            db.rollback()
+
+            if len(topio_assets) == 1:
+                raise
+
+        # a failing registration must not fail the others of the batch, so
+        # the assets are registered one by one
+        results = []
+
+        for topio_asset in topio_assets:
+            try:
+                results.append(_register_assets([topio_asset], db)[0])
+            except Exception as e:
+                db.rollback()
+                results.append(e)
+
+        return results
+    finally:
+        db.close()
+
+
+def _add_pending_asset(
+        topio_id: str, owner_id: int, asset_type: str, local_id: str):
+
+    if local_id is None:
+        return
+
+    with pending_assets_lock:
+        pending_topio_ids[(owner_id, asset_type, local_id)] = topio_id
+        pending_local_ids[topio_id] = local_id
+
+
+def _remove_pending_asset(
+        topio_id: str, owner_id: int, asset_type: str, local_id: str):
+
+    if local_id is None:
+        return
+
+    asset_key = (owner_id, asset_type, local_id)
+
+    with pending_assets_lock:
+        if pending_topio_ids.get(asset_key) == topio_id:
+            del pending_topio_ids[asset_key]
+
+        pending_local_ids.pop(topio_id, None)
+
+
+def _asset_id(topio_id: str, asset_type: str) -> int:
+    # the asset type makes the split of the topio ID unambiguous
+    return next(
+        asset_id
+        for asset_id, candidate_asset_type, _
+        in topio_id_to_candidate_parts(topio_id)
+        if candidate_asset_type == asset_type)
+
+
+def _journaled_asset_key(record: dict) -> Tuple[int, str, str]:
+    return record['owner_id'], record['asset_type'], record['local_id']
+
+
+def _flush_journaled_assets(records: List[dict]):
+    """
+    Inserts the given journaled assets. Assets whose key was registered
+    concurrently are dropped. Afterwards, the given assets are not pending
+    anymore, and the topio IDs registered for their keys are cached.
+    """
+    from ompid.db import SessionLocal
+    db = SessionLocal()
+
+    try:
+        inserted_assets = db.execute(
+            INSERT_JOURNALED_ASSETS_QUERY,
+            {
+                'ids': [record['id'] for record in records],
+                'local_ids': [record['local_id'] for record in records],
+                'owner_ids': [record['owner_id'] for record in records],
+                'asset_types': [record['asset_type'] for record in records],
+                'descriptions': [record['description'] for record in records],
+                'topio_ids': [record['topio_id'] for record in records],
+            }).fetchall()
+
+        inserted_asset_ids = {asset.id for asset in inserted_assets}
+
+        # records which were not inserted were either inserted before a crash
+        # already, or their keys are registered under other topio IDs
+        skipped_records = [
+            record for record in records
+            if record['id'] not in inserted_asset_ids
+            and record['local_id'] is not None]
+        registered_topio_ids = {}
+
+        if skipped_records:
+            owner_ids, asset_types, local_ids = zip(*(
+                _journaled_asset_key(record) for record in skipped_records))
+            registered_topio_ids = {
+                (asset.owner_id, asset.asset_type, asset.local_id):
+                    asset.topio_id
+                for asset in db.execute(
+                    RESOLVE_TOPIO_IDS_QUERY,
+                    {
+                        'owner_ids': list(owner_ids),
+                        'asset_types': list(asset_types),
+                        'local_ids': list(local_ids),
+                    })}
+
+        _announce_registered_assets(
+            [
+                (asset.owner_id, asset.asset_type, asset.local_id)
+                for asset in inserted_assets if asset.local_id is not None
+            ],
+            db)
+
+        db.commit()
+    finally:
+        db.close()
+
+    dropped_records = 0
+
+    for record in records:
+        asset_key = _journaled_asset_key(record)
+        topio_id = record['topio_id']
+
+        # unless the asset was inserted before a crash already, its key is
+        # registered under another topio ID
+        if record['id'] not in inserted_asset_ids \
+                and record['local_id'] is not None:
+
+            topio_id = registered_topio_ids.get(asset_key)
+
+            if topio_id != record['topio_id']:
+                dropped_records += 1
+
+        # cached before it stops being pending, so that it can be resolved
+        # without a gap
+        if topio_id is not None:
+            _cache_asset(topio_id, *asset_key)
+
+        _remove_pending_asset(record['topio_id'], *asset_key)
+
+    if dropped_records:
+        logger.warning(
+            f'Dropped {dropped_records} journaled assets whose local IDs were '
+            f'registered meanwhile')
+
+
+async def _ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """
+    Yields the lines of a newline-delimited request body while it is being
+    received, without holding more than one line in memory.
+    """
+    rest = b''
+
+    async for data in request.stream():
+        *lines, rest = (rest + data).split(b'\n')
+
+        for line in lines:
+            yield line
+
+    if rest:
+        yield rest
+
+
+def _import_assets_chunk(
+        chunk: List[Tuple[int, bytes]], db: Session) -> str:
+    """
+    Registers the assets given as (line number, JSON line) pairs. Assets whose
+    local ID is registered already, including assets imported before from
+    the same lines, are left as they are. Returns one NDJSON line per given
+    line, holding its line number and either the topio ID of the asset or
+    the reason the asset was not registered.
+    """
+    results = {}
+    topio_assets = []
+
+    for line_number, line in chunk:
+        try:
+            topio_assets.append(
+                (line_number, TopioAssetCreate.parse_raw(line)))
+        except pydantic.ValidationError as e:
+            results[line_number] = {
+                'line': line_number,
+                'errors': [
+                    {key: error[key] for key in ('loc', 'msg', 'type')}
+                    for error in e.errors()]}
+
+    owner_namespaces = _get_user_namespaces(
+        {topio_asset.owner_id for _, topio_asset in topio_assets}, db)
+    asset_types = {}
+
+    if topio_assets:
+        _, asset_types = asset_types_snapshot.get(
+            lambda: _load_asset_types_snapshot(db))
+
+    new_assets = []
+
+    for line_number, topio_asset in topio_assets:
+        if topio_asset.owner_id not in owner_namespaces:
+            results[line_number] = {
+                'line': line_number,
+                'error': f'No user registered with ID {topio_asset.owner_id}'}
+        elif topio_asset.asset_type not in asset_types:
+            results[line_number] = {
+                'line': line_number,
+                'error':
+                    f'No asset type registered with ID '
+                    f'{topio_asset.asset_type}'}
+        else:
+            new_assets.append((line_number, topio_asset))
+
+    asset_ids = asset_id_allocator.allocate(len(new_assets), db)
+    imported_assets = [
+        TopioAsset(
+            **topio_asset.dict(),
+            id=asset_id,
+            topio_id=build_topio_id(
+                owner_namespaces[topio_asset.owner_id],
+                asset_id,
+                topio_asset.asset_type))
+        for (_, topio_asset), asset_id in zip(new_assets, asset_ids)]
+
+    if imported_assets:
+        from ompid.db import copy_rows
+
+        db.execute(CREATE_IMPORT_TABLE_STATEMENT)
+        copy_rows(
+            db,
+            'import_asset',
+            IMPORT_ASSET_COLUMNS,
+            (
+                [getattr(asset, column) for column in IMPORT_ASSET_COLUMNS]
+                for asset in imported_assets
+            ))
+
+        inserted_asset_ids = {
+            asset_id for asset_id, in db.execute(INSERT_IMPORTED_ASSETS_QUERY)}
+
+        # assets which were not inserted are registered already
+        skipped_keys = [
+            (asset.owner_id, asset.asset_type, asset.local_id)
+            for asset in imported_assets if asset.id not in inserted_asset_ids]
+        registered_topio_ids = {}
+
+        if skipped_keys:
+            owner_ids, asset_types, local_ids = zip(*skipped_keys)
+            registered_topio_ids = {
+                (asset.owner_id, asset.asset_type, asset.local_id):
+                    asset.topio_id
+                for asset in db.execute(
+                    RESOLVE_TOPIO_IDS_QUERY,
+                    {
+                        'owner_ids': list(owner_ids),
+                        'asset_types': list(asset_types),
+                        'local_ids': list(local_ids),
+                    })}
+
+        _announce_registered_assets(
+            [
+                (asset.owner_id, asset.asset_type, asset.local_id)
+                for asset in imported_assets
+                if asset.id in inserted_asset_ids
+                and asset.local_id is not None
+            ],
+            db)
+
+        db.commit()
+
+        for (line_number, _), asset in zip(new_assets, imported_assets):
+            if asset.id in inserted_asset_ids:
+                topio_id = asset.topio_id
+            else:
+                topio_id = registered_topio_ids[
+                    (asset.owner_id, asset.asset_type, asset.local_id)]
+
+            _cache_asset(
+                topio_id, asset.owner_id, asset.asset_type, asset.local_id)
+            results[line_number] = {'line': line_number, 'topio_id': topio_id}
+
+    return ''.join(
+        json.dumps(results[line_number]) + '\n'
+        for line_number in sorted(results))
+
+
+async def _import_assets(
+        request: Request, db: Session) -> AsyncIterator[str]:
+    chunk = []
+    line_number = 0
+
+    async for line in _ndjson_lines(request):
+        line_number += 1
+
+        if not line.strip():
+            continue
+
+        chunk.append((line_number, line))
+
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            yield await run_in_threadpool(_import_assets_chunk, chunk, db)
+            chunk = []
+
+    if chunk:
+        yield await run_in_threadpool(_import_assets_chunk, chunk, db)
+
+
+def _parse_topio_id(topio_id: str) -> List[Tuple[int, str, str]]:
+    try:
+        return topio_id_to_candidate_parts(topio_id)
+    except (TypeError, ValueError):
+        raise HTTPException(422, f'Malformed topio ID {topio_id}')
+
+
+def _resolve_local_ids(
+        topio_ids: List[str], db: Session) -> List[Optional[str]]:
+    """
+    Returns the local IDs of the assets with the given topio IDs in the given
+    order. Entries are None if there is no such asset or the asset has no
+    local ID. Journaled assets which are not flushed yet are resolved, too.
+
+    The asset IDs are parsed from the topio IDs, so all topio IDs missing in
+    the resolution cache are resolved with one primary key lookup. A topio ID
+    whose namespace or asset type contains `.<digits>.` parts can be split in
+    several ways, so every asset ID it may contain is looked up. Comparing
+    the stored topio IDs of the fetched rows picks the right one and checks
+    the owner namespaces and asset types of the given topio IDs. Asset IDs
+    out of the range of the id column can't exist and are not looked up.
+    Malformed topio IDs are rejected with a 422 error before any database
+    access.
+    """
+    candidate_asset_ids = {
+        topio_id: [
+            asset_id for asset_id, _, _ in _parse_topio_id(topio_id)
+            if asset_id <= MAX_ID]
+        for topio_id in topio_ids}
+    local_ids = {
+        topio_id: local_id_cache.get(topio_id)
+        for topio_id in candidate_asset_ids}
+    uncached_asset_ids = [
+        asset_id
+        for topio_id, local_id in local_ids.items() if local_id is None
+        for asset_id in candidate_asset_ids[topio_id]]
+
+    if uncached_asset_ids:
+        assets = db\
+            .query(
+                TopioAssetORM.topio_id,
+                TopioAssetORM.owner_id,
+                TopioAssetORM.asset_type,
+                TopioAssetORM.local_id)\
+            .filter(TopioAssetORM.id == any_(bindparam(
+                'asset_ids', uncached_asset_ids, type_=ARRAY(Integer))))\
+            .all()
+
+        for asset in assets:
+            if asset.topio_id not in local_ids:
+                continue
+
+            local_ids[asset.topio_id] = asset.local_id
+            _cache_asset(
+                asset.topio_id, asset.owner_id, asset.asset_type, asset.local_id)
+
+    return [
+        local_ids[topio_id] or pending_local_ids.get(topio_id)
+        for topio_id in topio_ids]
+
+
+def _resolve_local_id(topio_id: str, db: Session) -> Optional[str]:
+    return _resolve_local_ids([topio_id], db)[0]
+
+
+app = FastAPI()
+
+
+@app.on_event('startup')
+def init_tables():
+    import ompid.db
+    Base.metadata.create_all(ompid.db.engine)
+    ompid.db.upgrade_schema(ompid.db.engine)
+
+
+@app.on_event('startup')
+def init_write_behind_journal():
+    global registration_journal
+
+    write_behind_settings = \
+        load_default_configuration().get('write_behind') or {}
 
+    if not write_behind_settings.get('enabled', False):
+        return
 
-async def get_db():
+    # replays the segments left by a process that didn't stop cleanly
+    registration_journal = WriteBehindJournal(
+        write_behind_settings.get(
+            'directory', DEFAULT_WRITE_BEHIND_DIRECTORY),
+        _flush_journaled_assets,
+        write_behind_settings.get(
+            'flush_interval', DEFAULT_WRITE_BEHIND_FLUSH_INTERVAL))
+    registration_journal.start()
+
+
+@app.on_event('startup')
+def init_caches():
+    cache_settings = load_default_configuration().get('cache') or {}
+    resolution_cache_size = cache_settings.get(
+        'resolution_cache_size', DEFAULT_RESOLUTION_CACHE_SIZE)
+
+    topio_id_cache.resize(resolution_cache_size)
+    local_id_cache.resize(resolution_cache_size)
+
+    user_cache_size = cache_settings.get(
+        'user_cache_size', DEFAULT_USER_CACHE_SIZE)
+    users_cache.resize(user_cache_size)
+    user_ids_cache.resize(user_cache_size)
+
+    id_allocation_settings = \
+        load_default_configuration().get('id_allocation') or {}
+    asset_id_allocator.block_size = id_allocation_settings.get('block_size', 1)
+
+    asset_types_snapshot.max_age = cache_settings.get(
+        'asset_types_snapshot_max_age', DEFAULT_ASSET_TYPES_SNAPSHOT_MAX_AGE)
+
+    global not_found_max_age
+    http_cache_settings = load_default_configuration().get('http_cache') or {}
+    not_found_max_age = http_cache_settings.get(
+        'not_found_max_age', DEFAULT_NOT_FOUND_MAX_AGE)
+
+
+@app.on_event('startup')
+def init_asset_registration_coalescer():
+    global asset_registration_coalescer
+
+    coalescing_settings = \
+        load_default_configuration().get('write_coalescing') or {}
+
+    if not coalescing_settings.get('enabled', False):
+        return
+
+    asset_registration_coalescer = WriteCoalescer(
+        _flush_asset_registrations,
+        coalescing_settings.get(
+            'window_ms', DEFAULT_WRITE_COALESCING_WINDOW_MS) / 1000,
+        coalescing_settings.get(
+            'max_batch_size', DEFAULT_WRITE_COALESCING_MAX_BATCH_SIZE))
+
+
+@app.on_event('startup')
+def warm_user_caches():
     from ompid.db import SessionLocal
     db = SessionLocal()
 
     try:
-        yield db
+        users = db\
+            .query(
+                TopioUserORM.id,
+                TopioUserORM.name,
+                TopioUserORM.user_namespace)\
+            .order_by(TopioUserORM.id.desc())\
+            .limit(users_cache.maxsize)\
+            .yield_per(USER_CACHE_WARMING_CHUNK_SIZE)
+
+        for user in users:
+            _cache_user(TopioUser.from_orm(user))
     finally:
         db.close()
 
-app = FastAPI()
-
 
 @app.on_event('startup')
-def init_tables():
+def init_notification_listener():
+    global notification_listener
     import ompid.db
-    Base.metadata.create_all(ompid.db.engine)
+
+    cfg = load_default_configuration()
+    listener = ompid.db.NotificationListener(ompid.db.engine)
+
+    # asset types registered while the listener was disconnected are only
+    # known after invalidating the snapshot on reconnect
+    listener.subscribe(
+        ASSET_TYPES_CHANNEL, lambda _: asset_types_snapshot.invalidate())
+    listener.on_connect(asset_types_snapshot.invalidate)
+
+    filter_settings = cfg.get('negative_lookup_filter') or {}
+
+    if filter_settings.get('enabled', False):
+        registered_assets_filter.capacity = filter_settings.get(
+            'capacity', DEFAULT_NEGATIVE_LOOKUP_FILTER_CAPACITY)
+        registered_assets_filter.error_rate = filter_settings.get(
+            'error_rate', DEFAULT_NEGATIVE_LOOKUP_FILTER_ERROR_RATE)
+        registered_assets_filter.enabled = True
+
+        # The filter is (re-)built from the table after each (re-)connect of
+        # the listener, so no registration announced in the meantime is lost.
+        # Until then every lookup goes to the database.
+        listener.subscribe(ASSET_REGISTRATIONS_CHANNEL, _on_asset_registrations)
+        listener.on_connect(_rebuild_registered_assets_filter)
+
+    if listener.has_subscriptions():
+        listener.start()
+        notification_listener = listener
 
 
-@app.post('/users/register', response_model=TopioUser, responses={201: {"model": TopioUser}})
+@app.on_event('shutdown')
+def stop_notification_listener():
+    if notification_listener is not None:
+        notification_listener.stop()
+
+
+@app.on_event('shutdown')
+def stop_write_behind_journal():
+    if registration_journal is not None:
+        registration_journal.stop()
+
+
+@app.post('/users/register', response_model=TopioUser, responses={201: {"model": TopioUser}, 409: {"model": str}})
 async def register_user(topio_user: TopioUserCreate, db: Session = Depends(get_db)):
+    """
+    Registers a user. Registering the same name and namespace again returns
+    the registered user with status 200 instead of 201. If the name or the
+    namespace is taken by another user, 409 is returned.
+    """
+    try:
+        registered_user = db.execute(
+            REGISTER_USER_QUERY,
+            {
+                'name': topio_user.name,
+                'user_namespace': topio_user.user_namespace
+            }).first()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
 
-    topio_user_orm = (
-        db
-        .query(TopioUserORM)
-        .filter(and_(TopioUserORM.name == topio_user.name, TopioUserORM.user_namespace == topio_user.user_namespace))
-        .first()
-    )
+        if e.orig.pgcode != UNIQUE_VIOLATION:
+            raise
 
-    if not topio_user_orm is None:
-        return topio_user_orm
+        raise HTTPException(
+            409, f'User name {topio_user.name} is already registered')
 
-    topio_user_orm = TopioUserORM(
-        name=topio_user.name, user_namespace=topio_user.user_namespace)
+    if registered_user.name != topio_user.name:
+        raise HTTPException(
+            409,
+            f'User namespace {topio_user.user_namespace} is already '
+            f'registered')
 
-    db.add(topio_user_orm)
-    db.commit()
-    db.refresh(topio_user_orm)
+    user = TopioUser.from_orm(registered_user)
+    _cache_user(user)
 
-    topio_user_json = jsonable_encoder(topio_user_orm)
-    return JSONResponse(status_code=201, content=topio_user_json)
+    if not registered_user.created:
+        return user
 
+    return JSONResponse(status_code=201, content=jsonable_encoder(user))
 
-@app.get('/users/{topio_user_id}', response_model=TopioUser)
-async def get_user_info(topio_user_id: int, db: Session = Depends(get_db)):
-    topio_user_orm = \
-        db.query(TopioUserORM).filter(TopioUserORM.id == topio_user_id).first()
 
-    return topio_user_orm
+@app.post('/users/register_bulk', response_model=List[int], responses={409: {"model": str}, 413: {"model": str}})
+async def register_users(
+        topio_users: List[TopioUserCreate], db: Session = Depends(get_db)):
+    """
+    Bulk variant of /users/register. All users are registered with one
+    statement in one transaction; users registered already are left as they
+    are. If any name or namespace is taken by another user, none is
+    registered.
+
+    :param topio_users: a list of at most MAX_BULK_REGISTRATION_SIZE users
+    :param db: database session (will be provided by FastAPI's dependency
+        injection mechanism.
+    :return: A list containing the ID of each user in the order of the
+        request
+    """
+    if len(topio_users) > MAX_BULK_REGISTRATION_SIZE:
+        raise HTTPException(
+            413,
+            f'At most {MAX_BULK_REGISTRATION_SIZE} users can be registered '
+            f'at once')
+
+    # A row can only be upserted once per statement, so every namespace is
+    # sent once. Sorting them makes concurrent bulk registrations lock the
+    # rows of existing users in the same order, which rules out deadlocks.
+    names = {}
+
+    for topio_user in topio_users:
+        if names.setdefault(topio_user.user_namespace, topio_user.name) \
+                != topio_user.name:
+            raise HTTPException(
+                409,
+                f'User namespace {topio_user.user_namespace} is given for '
+                f'more than one user name')
+
+    user_namespaces = sorted(names)
+
+    try:
+        registered_users = db.execute(
+            REGISTER_USERS_QUERY,
+            {
+                'names': [names[ns] for ns in user_namespaces],
+                'user_namespaces': user_namespaces
+            }).fetchall()
+
+        for registered_user in registered_users:
+            if registered_user.name != names[registered_user.user_namespace]:
+                raise HTTPException(
+                    409,
+                    f'User namespace {registered_user.user_namespace} is '
+                    f'already registered')
+
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+
+        if e.orig.pgcode != UNIQUE_VIOLATION:
+            raise
+
+        raise HTTPException(
+            409,
+            f'A user name is already registered: '
+            f'{e.orig.diag.message_detail}')
+    except HTTPException:
+        db.rollback()
+        raise
+
+    user_ids = {}
+
+    for registered_user in registered_users:
+        user = TopioUser.from_orm(registered_user)
+        _cache_user(user)
+        user_ids[user.user_namespace] = user.id
+
+    return [user_ids[topio_user.user_namespace] for topio_user in topio_users]
+
 
+@app.get('/users/{topio_user_id}', response_model=TopioUser, responses={404: {"model": str}})
+async def get_user_info(
+        topio_user_id: int,
+        request: Request,
+        response: Response,
+        db: Session = Depends(get_read_db)):
 
-@app.post('/asset_types/register', response_model=TopioAssetType, responses={201: {"model": TopioAssetType}})
+    etag = _etag('user', topio_user_id)
+
+    if _is_not_modified(request, etag):
+        return _not_modified_response(etag)
+
+    user = _get_user(topio_user_id, db)
+
+    if user is None:
+        raise HTTPException(
+            404,
+            f'No user registered with ID {topio_user_id}',
+            headers=_not_found_headers())
+
+    response.headers.update(_immutable_headers(etag))
+
+    return user
+
+
+@app.get('/users/by_namespace/{user_namespace}', response_model=TopioUser, responses={404: {"model": str}})
+async def get_user_by_namespace(
+        user_namespace: str,
+        request: Request,
+        response: Response,
+        db: Session = Depends(get_read_db)):
+    """
+    Returns the user owning the given user namespace, without any database
+    access if the user cache is warm.
+    """
+    etag = _etag('user_namespace', user_namespace)
+
+    if _is_not_modified(request, etag):
+        return _not_modified_response(etag)
+
+    user = _get_user_by_namespace(user_namespace, db)
+
+    if user is None:
+        raise HTTPException(
+            404,
+            f'No user registered with namespace {user_namespace}',
+            headers=_not_found_headers())
+
+    response.headers.update(_immutable_headers(etag))
+
+    return user
+
+
+@app.post('/asset_types/register', response_model=TopioAssetType, responses={201: {"model": TopioAssetType}, 409: {"model": str}})
 async def register_asset_type(
         topio_asset_type: TopioAssetType, db: Session = Depends(get_db)):
+    """
+    Registers an asset type. Registering the same ID and description again
+    returns the registered asset type with status 200 instead of 201. If the
+    ID is registered with another description, 409 is returned.
+    """
+    registered_asset_type = db.execute(
+        REGISTER_ASSET_TYPE_QUERY,
+        {
+            'id': topio_asset_type.id,
+            'description': topio_asset_type.description
+        }).first()
 
-    topio_asset_type_orm = (
-        db
-        .query(TopioAssetTypeORM)
-        .filter(and_(TopioAssetTypeORM.id == topio_asset_type.id, TopioAssetTypeORM.description == topio_asset_type.description))
-        .first()
-    )
+    if registered_asset_type.created:
+        from ompid.db import notify
+        notify(db, ASSET_TYPES_CHANNEL, [topio_asset_type.id])
+
+    db.commit()
+
+    if registered_asset_type.description != topio_asset_type.description:
+        raise HTTPException(
+            409,
+            f'Asset type {topio_asset_type.id} is already registered with '
+            f'another description')
 
-    if not topio_asset_type_orm is None:
-        return topio_asset_type_orm
+    asset_type = TopioAssetType.from_orm(registered_asset_type)
 
-    topio_asset_type_orm = TopioAssetTypeORM(
-        id=topio_asset_type.id, description=topio_asset_type.description)
+    if not registered_asset_type.created:
+        return asset_type
 
-    db.add(topio_asset_type_orm)
-    db.commit()
-    db.refresh(topio_asset_type_orm)
+    asset_types_snapshot.invalidate()
 
-    topio_asset_type_json = jsonable_encoder(topio_asset_type_orm)
-    return JSONResponse(status_code=201, content=topio_asset_type_json)
+    return JSONResponse(status_code=201, content=jsonable_encoder(asset_type))
 
 
-@app.get('/asset_types/{topio_asset_type_id}', response_model=TopioAssetType)
+# The asset type endpoints read from the primary: the session only connects
+# when the snapshot is rebuilt, which must not happen on a replica lagging
+# behind the invalidating registration.
+@app.get('/asset_types/{topio_asset_type_id}', response_model=TopioAssetType, responses={404: {"model": str}})
 async def get_asset_namespace_info(
-        topio_asset_type_id: str, db: Session = Depends(get_db)):
+        topio_asset_type_id: str,
+        request: Request,
+        db: Session = Depends(get_db)):
 
-    topio_asset_type_orm = db\
-        .query(TopioAssetTypeORM)\
-        .filter(TopioAssetTypeORM.id == topio_asset_type_id)\
-        .first()
+    _, asset_types = asset_types_snapshot.get(
+        lambda: _load_asset_types_snapshot(db))
+
+    if topio_asset_type_id not in asset_types:
+        raise HTTPException(
+            404,
+            f'No asset type registered with ID {topio_asset_type_id}')
+
+    body, etag = asset_types[topio_asset_type_id]
 
-    return topio_asset_type_orm
+    return _json_body_response(request, body, etag)
 
 
 @app.get('/asset_types/', response_model=List[TopioAssetType])
-async def get_asset_types(db: Session = Depends(get_db)):
-    return db.query(TopioAssetTypeORM).all()
+async def get_asset_types(request: Request, db: Session = Depends(get_db)):
+    (body, etag), _ = asset_types_snapshot.get(
+        lambda: _load_asset_types_snapshot(db))
 
+    return _json_body_response(request, body, etag)
 
-@app.post('/assets/register', response_model=TopioAsset)
+
+@app.post('/assets/register', response_model=TopioAsset, responses={201: {"model": TopioAsset}, 404: {"model": str}})
 async def register_asset(topio_asset: TopioAssetCreate, db: Session = Depends(get_db)):
-    topio_asset_orm = TopioAssetORM(
-        local_id=topio_asset.local_id,
-        owner_id=topio_asset.owner_id,
-        asset_type=topio_asset.asset_type,
-        description=topio_asset.description)
+    """
+    Registers an asset. Registration is idempotent: if the local ID is
+    registered already for the given owner and asset type, the registered
+    asset is returned with status 200 instead of 201.
+    """
+    # unknown asset types would make the insert fail with a foreign key
+    # violation
+    _, asset_types = asset_types_snapshot.get(
+        lambda: _load_asset_types_snapshot(db))
 
-    db.add(topio_asset_orm)
-    db.commit()
-    db.refresh(topio_asset_orm)
+    if topio_asset.asset_type not in asset_types:
+        raise HTTPException(
+            404,
+            f'No asset type registered with ID {topio_asset.asset_type}')
+
+    if asset_registration_coalescer is not None:
+        asset = await asset_registration_coalescer.submit(topio_asset)
+    else:
+        asset = _register_assets([topio_asset], db)[0]
+
+    if asset is None:
+        raise HTTPException(
+            404,
+            f'No user registered with ID {topio_asset.owner_id}')
+
+    registered_asset = TopioAsset.from_orm(asset)
+
+    if not asset.created:
+        return registered_asset
+
+    return JSONResponse(
+        status_code=201, content=jsonable_encoder(registered_asset))
+
+
+@app.post('/assets/register_journaled', response_model=TopioAsset, status_code=202, responses={200: {"model": TopioAsset}, 404: {"model": str}, 503: {"model": str}})
+async def register_asset_journaled(
+        topio_asset: TopioAssetCreate, db: Session = Depends(get_db)):
+    """
+    Write-behind variant of /assets/register: the asset is acknowledged with
+    status 202 once it is appended to the local journal, and written to the
+    database by a background flusher shortly after. Its topio ID is built
+    from an ID taken from asset_id_allocator, so it can be returned right
+    away, and it can be resolved in this worker process immediately.
+
+    Assets registered already are returned with status 200, assets journaled
+    by this worker process and not flushed yet with status 202 again. The
+    202 is no guarantee that the returned topio ID will be registered,
+    though: an asset whose local ID is registered concurrently by another
+    worker process is dropped when its journal segment is flushed, and the
+    topio ID registered for the local ID is resolved from then on. Until the
+    flush, resolutions of the asset are thus only cacheable briefly.
+    """
+    if registration_journal is None:
+        raise HTTPException(503, 'Write-behind registration is not enabled')
+
+    if topio_asset.local_id is not None:
+        asset_key = \
+            (topio_asset.owner_id, topio_asset.asset_type, topio_asset.local_id)
+        topio_id = topio_id_cache.get(asset_key)
+
+        if topio_id is None and registered_assets_filter.might_contain(
+                _asset_filter_key(*asset_key)):
+
+            asset = db\
+                .query(TopioAssetORM.topio_id)\
+                .filter(TopioAssetORM.owner_id == topio_asset.owner_id,
+                        TopioAssetORM.asset_type == topio_asset.asset_type,
+                        TopioAssetORM.local_id == topio_asset.local_id)\
+                .first()
+
+            if asset is not None:
+                topio_id = asset.topio_id
+
+        if topio_id is not None:
+            registered_asset = TopioAsset(
+                **topio_asset.dict(),
+                id=_asset_id(topio_id, topio_asset.asset_type),
+                topio_id=topio_id)
+
+            return JSONResponse(
+                status_code=200, content=jsonable_encoder(registered_asset))
+
+        topio_id = pending_topio_ids.get(asset_key)
+
+        if topio_id is not None:
+            return TopioAsset(
+                **topio_asset.dict(),
+                id=_asset_id(topio_id, topio_asset.asset_type),
+                topio_id=topio_id)
+
+    owner_namespace = _get_user_namespaces([topio_asset.owner_id], db)\
+        .get(topio_asset.owner_id)
+
+    if owner_namespace is None:
+        raise HTTPException(
+            404,
+            f'No user registered with ID {topio_asset.owner_id}')
+
+    # unknown asset types would make the whole journal segment fail to flush
+    _, asset_types = asset_types_snapshot.get(
+        lambda: _load_asset_types_snapshot(db))
+
+    if topio_asset.asset_type not in asset_types:
+        raise HTTPException(
+            404,
+            f'No asset type registered with ID {topio_asset.asset_type}')
+
+    asset_id = asset_id_allocator.allocate(1, db)[0]
+    registered_asset = TopioAsset(
+        **topio_asset.dict(),
+        id=asset_id,
+        topio_id=build_topio_id(
+            owner_namespace, asset_id, topio_asset.asset_type))
+
+    asset_key = (
+        registered_asset.owner_id,
+        registered_asset.asset_type,
+        registered_asset.local_id)
+
+    # Added before appending, as the flusher may write the asset right after
+    # the append and must find it pending. Concurrent requests for the same
+    # local ID get this asset from then on.
+    _add_pending_asset(registered_asset.topio_id, *asset_key)
+
+    try:
+        await run_in_threadpool(
+            registration_journal.append, [registered_asset.dict()])
+    except Exception:
+        _remove_pending_asset(registered_asset.topio_id, *asset_key)
+        raise
+
+    return registered_asset
+
+
+@app.post('/assets/import', response_class=StreamingResponse)
+async def import_assets(request: Request, db: Session = Depends(get_db)):
+    """
+    Registers the assets given as newline-delimited JSON objects like those
+    accepted by /assets/register while the request body is still being
+    received. Every IMPORT_CHUNK_SIZE lines are validated, loaded with COPY
+    and committed together, and the results are streamed back right away as
+    newline-delimited JSON, one object per non-empty line in the order of the
+    request:
+
+    - {"line": 1, "topio_id": "topio.abc.1.file"} for registered assets
+    - {"line": 2, "error": "..."} or {"line": 2, "errors": [...]} for lines
+      which were rejected
+
+    Assets registered already, e.g. by an earlier attempt of an interrupted
+    import, are answered with their registered topio IDs, so imports can be
+    retried safely.
+    """
+    return StreamingResponse(
+        _import_assets(request, db), media_type=NDJSON_MEDIA_TYPE)
+
+
+@app.get('/assets/register/stats')
+async def get_asset_registration_stats():
+    """
+    Returns the batch size statistics of the asset registration coalescer,
+    or null if write coalescing is not enabled.
+    """
+    if asset_registration_coalescer is None:
+        return None
+
+    return asset_registration_coalescer.stats()
+
+
+@app.post('/assets/register_bulk', response_model=List[str], status_code=201, responses={404: {"model": str}, 409: {"model": str}, 413: {"model": str}})
+async def register_assets(
+        topio_assets: List[TopioAssetCreate],
+        db: Session = Depends(get_db)):
+    """
+    Bulk variant of /assets/register. All assets are registered in one
+    transaction: the asset IDs are taken from asset_id_allocator, which needs
+    at most one statement, the topio IDs are built from them and the cached
+    owner namespaces and the assets are loaded with COPY. If any asset can't
+    be registered, none is.
+
+    :param topio_assets: a list of at most MAX_BULK_REGISTRATION_SIZE assets
+    :param db: database session (will be provided by FastAPI's dependency
+        injection mechanism.
+    :return: A list containing the topio ID of each registered asset in the
+        order of the request
+    """
+    if len(topio_assets) > MAX_BULK_REGISTRATION_SIZE:
+        raise HTTPException(
+            413,
+            f'At most {MAX_BULK_REGISTRATION_SIZE} assets can be registered '
+            f'at once')
 
-    return topio_asset_orm
+    if not topio_assets:
+        return []
+
+    owner_namespaces = _get_user_namespaces(
+        {topio_asset.owner_id for topio_asset in topio_assets}, db)
+
+    # unknown asset types would make COPY fail with a foreign key violation
+    _, asset_types = asset_types_snapshot.get(
+        lambda: _load_asset_types_snapshot(db))
+
+    for topio_asset in topio_assets:
+        if topio_asset.owner_id not in owner_namespaces:
+            raise HTTPException(
+                404,
+                f'No user registered with ID {topio_asset.owner_id}')
+
+        if topio_asset.asset_type not in asset_types:
+            raise HTTPException(
+                404,
+                f'No asset type registered with ID {topio_asset.asset_type}')
+
+    asset_ids = asset_id_allocator.allocate(len(topio_assets), db)
+
+    topio_ids = [
+        build_topio_id(
+            owner_namespaces[topio_asset.owner_id],
+            asset_id,
+            topio_asset.asset_type)
+        for topio_asset, asset_id in zip(topio_assets, asset_ids)]
+
+    from ompid.db import copy_rows
+
+    try:
+        copy_rows(
+            db,
+            TopioAssetORM.__tablename__,
+            ('id', 'local_id', 'owner_id', 'asset_type', 'description',
+             'topio_id'),
+            (
+                (asset_id, topio_asset.local_id, topio_asset.owner_id,
+                 topio_asset.asset_type, topio_asset.description, topio_id)
+                for topio_asset, asset_id, topio_id
+                in zip(topio_assets, asset_ids, topio_ids)
+            ))
+
+        _announce_registered_assets(
+            [
+                (topio_asset.owner_id, topio_asset.asset_type,
+                 topio_asset.local_id)
+                for topio_asset in topio_assets
+                if topio_asset.local_id is not None
+            ],
+            db)
+
+        db.commit()
+    except psycopg2.IntegrityError as e:
+        db.rollback()
+
+        if e.pgcode != UNIQUE_VIOLATION:
+            raise
+
+        raise HTTPException(
+            409,
+            f'A local ID is registered more than once for the same owner and '
+            f'asset type: {e.diag.message_detail}')
+
+    for topio_asset, topio_id in zip(topio_assets, topio_ids):
+        _cache_asset(
+            topio_id,
+            topio_asset.owner_id,
+            topio_asset.asset_type,
+            topio_asset.local_id)
+
+    return topio_ids
 
 
 @app.get('/assets/topio_id', response_model=str, responses={404: {"model": str}})
@@ -133,59 +1623,296 @@ async def get_topio_id(
         owner_id: int,
         asset_type: str, 
         local_id: str,
-        db: Session = Depends(get_db)):
+        request: Request,
+        response: Response,
+        db: Session = Depends(get_read_db)):
     """
     Returns the topio ID for a given asset identified by
     - the asset owner ID
     - the asset type
     - the asset's local ID (e.g. hdfs://foo/bar, postgresql://user:pw@dbhost/db)
 
+    Found topio IDs are returned with an ETag and may be cached forever;
+    conditional requests are answered with 304 without any lookup. Topio IDs
+    of journaled assets which are not flushed yet are only cacheable briefly.
+
     :param owner_id: the asset owner ID
     :param asset_type: the asset type
     :param local_id: the asset's local ID
+    :param request: the HTTP request (will be provided by FastAPI)
+    :param response: the HTTP response whose headers are set (will be
+        provided by FastAPI)
     :param db: database session (will be provided by FastAPI's dependency
         injection mechanism.
     :return: A string containing the topio ID of the respective asset
     """
+    etag = _etag('topio_id', owner_id, asset_type, local_id)
 
-    asset = db\
-        .query(TopioAssetORM)\
-        .filter(TopioAssetORM.owner_id == owner_id,
-                TopioAssetORM.asset_type == asset_type,
-                TopioAssetORM.local_id == local_id)\
-        .first()
+    if _is_not_modified(request, etag):
+        return _not_modified_response(etag)
 
-    if asset is None:
-        return Response(status_code=404, content='No topio ID found for the given parameters')
+    topio_id = topio_id_cache.get((owner_id, asset_type, local_id))
+
+    if topio_id is None and registered_assets_filter.might_contain(
+            _asset_filter_key(owner_id, asset_type, local_id)):
+
+        # Only the stored topio ID is selected, so the lookup is a single
+        # probe on ix_topio_asset_owner_type_local_id instead of loading the
+        # whole ORM entity (including the owner_namespace subquery).
+        asset = db\
+            .query(TopioAssetORM.topio_id)\
+            .filter(TopioAssetORM.owner_id == owner_id,
+                    TopioAssetORM.asset_type == asset_type,
+                    TopioAssetORM.local_id == local_id)\
+            .first()
+
+        if asset is not None:
+            topio_id = asset.topio_id
+            _cache_asset(topio_id, owner_id, asset_type, local_id)
+
+    if topio_id is None:
+        topio_id = pending_topio_ids.get((owner_id, asset_type, local_id))
+
+        if topio_id is not None:
+            response.headers.update(_pending_headers())
+            return topio_id
+
+    if topio_id is None:
+        return Response(
+            status_code=404,
+            content='No topio ID found for the given parameters',
+            headers=_not_found_headers())
+
+    response.headers.update(_immutable_headers(etag))
+
+    return topio_id
 
-    return asset.topio_id
+
+@app.post('/assets/topio_ids/resolve', response_model=List[Optional[str]])
+async def resolve_topio_ids(
+        asset_keys: List[TopioAssetKey],
+        db: Session = Depends(get_read_db)):
+    """
+    Bulk variant of /assets/topio_id. All keys not found in the resolution
+    cache are resolved with a single SQL statement.
+
+    :param asset_keys: a list of (owner ID, asset type, local ID) objects
+    :param db: database session (will be provided by FastAPI's dependency
+        injection mechanism.
+    :return: A list containing the topio ID of each given asset key in the
+        order of the request, or null if the key is not registered
+    """
+    keys = [(k.owner_id, k.asset_type, k.local_id) for k in asset_keys]
+    topio_ids = {key: topio_id_cache.get(key) for key in keys}
+    # keys with owner IDs which can't be cast to INTEGER are not registered
+    uncached_keys = [
+        key for key, topio_id in topio_ids.items()
+        if topio_id is None
+        and MIN_ID <= key[0] <= MAX_ID
+        and registered_assets_filter.might_contain(_asset_filter_key(*key))]
+
+    if uncached_keys:
+        owner_ids, asset_types, local_ids = zip(*uncached_keys)
+
+        assets = db.execute(
+            RESOLVE_TOPIO_IDS_QUERY,
+            {
+                'owner_ids': list(owner_ids),
+                'asset_types': list(asset_types),
+                'local_ids': list(local_ids),
+            })
+
+        for asset in assets:
+            _cache_asset(
+                asset.topio_id, asset.owner_id, asset.asset_type, asset.local_id)
+            topio_ids[(asset.owner_id, asset.asset_type, asset.local_id)] = \
+                asset.topio_id
+
+    return [topio_ids[key] or pending_topio_ids.get(key) for key in keys]
 
 
 @app.get('/assets/custom_id', response_model=str)
-async def get_custom_id(query: dict, db: Session = Depends(get_db)):
+async def get_custom_id(
+        query: dict,
+        request: Request,
+        response: Response,
+        db: Session = Depends(get_read_db)):
+
     topio_id: str = query.get('topio_id')
 
     if topio_id is None:
-        asset = None
+        local_id = None
     else:
-        asset = db\
-            .query(TopioAssetORM)\
-            .filter(
-                TopioAssetORM.topio_id == topio_id,
-                TopioAssetORM.local_id != None)\
-            .first()
+        etag = _etag('custom_id', topio_id)
 
-    if asset is None:
+        if _is_not_modified(request, etag):
+            return _not_modified_response(etag)
+
+        local_id = _resolve_local_id(topio_id, db)
+
+    if local_id is None:
+        raise HTTPException(
+            404,
+            f'No custom ID found for topio ID {topio_id}',
+            headers=_not_found_headers())
+
+    if topio_id in pending_local_ids:
+        response.headers.update(_pending_headers())
+    else:
+        response.headers.update(_immutable_headers(etag))
+
+    return local_id
+
+
+@app.post('/assets/custom_ids/resolve', response_model=List[Optional[str]])
+async def resolve_custom_ids(
+        topio_ids: List[str],
+        db: Session = Depends(get_read_db)):
+    """
+    Bulk variant of /assets/custom_id.
+
+    :param topio_ids: a list of topio IDs
+    :param db: database session (will be provided by FastAPI's dependency
+        injection mechanism.
+    :return: A list containing the local ID of each given topio ID in the
+        order of the request, or null if there is no such asset or the asset
+        has no local ID
+    """
+    return _resolve_local_ids(topio_ids, db)
+
+
+@app.get('/resolve/{topio_id:path}', response_class=RedirectResponse, status_code=302, responses={404: {"model": str}})
+async def resolve(
+        topio_id: str,
+        request: Request,
+        db: Session = Depends(get_read_db)):
+    """
+    Redirects to the location of the asset with the given topio ID, i.e. its
+    local ID (e.g. hdfs://foo/bar, https://example.com/data.csv), like
+    handle.net or DOI resolvers do.
+
+    :param topio_id: the topio ID to resolve
+    :param request: the HTTP request (will be provided by FastAPI)
+    :param db: database session (will be provided by FastAPI's dependency
+        injection mechanism.
+    :return: A 302 redirect to the asset's local ID
+    """
+    etag = _etag('resolve', topio_id)
+
+    if _is_not_modified(request, etag):
+        return _not_modified_response(etag)
+
+    local_id = _resolve_local_id(topio_id, db)
+
+    if local_id is None:
         raise HTTPException(
             404,
-            f'No custom ID found for topio ID {topio_id}')
+            f'No location found for topio ID {topio_id}',
+            headers=_not_found_headers())
+
+    if topio_id in pending_local_ids:
+        headers = _pending_headers()
+    else:
+        headers = _immutable_headers(etag)
 
-    return asset.local_id
+    return RedirectResponse(local_id, status_code=302, headers=headers)
 
 
 @app.get('/assets/', response_model=List[TopioAsset])
-async def get_users_assets(user: TopioUserQuery, db: Session = Depends(get_db)):
-    return db\
-        .query(TopioAssetORM)\
-        .filter(TopioAssetORM.owner_id == user.user_id)\
-        .all()
+async def get_users_assets(
+        user: TopioUserQuery,
+        request: Request,
+        response: Response,
+        fields: Optional[str] = None,
+        limit: Optional[int] = Query(None, gt=0, le=MAX_PAGE_SIZE),
+        next_page: Optional[str] = Query(None, alias='next'),
+        db: Session = Depends(get_read_db)):
+    """
+    Returns the assets of the given user ordered by asset ID.
+
+    A comma-separated list of `fields` (any TopioAsset field or
+    owner_namespace) restricts the returned attributes to these, and only
+    these columns are selected from the database.
+
+    Given a `limit`, at most that many assets are returned. If there are more,
+    the X-Next-Cursor response header holds an opaque cursor to be passed as
+    `next` parameter to get the following page. Pages start right after the
+    last asset ID of the previous page on the (owner_id, id) index, so deep
+    pages cost the same as the first one.
+
+    Clients accepting application/x-ndjson get the assets streamed as one
+    JSON object per line. Without a `limit`, they are read from the database
+    with a server-side cursor, so the memory needed does not depend on the
+    number of assets.
+    """
+    field_names = _parse_asset_fields(fields)
+
+    if field_names is None:
+        columns = list(ASSET_COLUMNS)
+    else:
+        columns = [ASSET_FIELDS[name] for name in field_names]
+
+        # needed to build the cursor of the next page
+        if limit is not None and 'id' not in field_names:
+            columns.append(TopioAssetORM.id)
+
+    assets = db\
+        .query(*columns)\
+        .select_from(TopioAssetORM)\
+        .filter(TopioAssetORM.owner_id == user.user_id)
+
+    if field_names is not None and 'owner_namespace' in field_names:
+        assets = assets.join(
+            TopioUserORM, TopioUserORM.id == TopioAssetORM.owner_id)
+
+    if next_page is not None:
+        assets = assets.filter(
+            TopioAssetORM.id > _decode_page_cursor(next_page))
+
+    assets = assets.order_by(TopioAssetORM.id)
+    headers = {}
+
+    if limit is not None:
+        assets = assets.limit(limit + 1).all()
+
+        if len(assets) > limit:
+            assets = assets[:limit]
+            headers[NEXT_PAGE_CURSOR_HEADER] = \
+                _encode_page_cursor(assets[-1].id)
+
+    if _wants_ndjson(request):
+        if limit is None:
+            assets = assets.yield_per(NDJSON_CHUNK_SIZE)
+
+        return StreamingResponse(
+            _ndjson_chunks(assets, NDJSON_CHUNK_SIZE, field_names),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=headers)
+
+    if limit is None:
+        assets = assets.all()
+
+    if field_names is not None:
+        # partial assets don't validate against the response model
+        return JSONResponse(
+            content=[_row_dict(asset, field_names) for asset in assets],
+            headers=headers)
+
+    response.headers.update(headers)
+
+    return assets
+
+
+@app.get('/cache/stats')
+async def get_cache_stats():
+    """
+    Returns size, hit, miss and eviction counters of the in-process caches of
+    the serving worker.
+    """
+    return {
+        'topio_id_cache': topio_id_cache.stats(),
+        'local_id_cache': local_id_cache.stats(),
+        'users_cache': users_cache.stats(),
+        'user_ids_cache': user_ids_cache.stats(),
+        'registered_assets_filter': registered_assets_filter.stats(),
+    }
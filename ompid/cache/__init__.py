@@ -0,0 +1,226 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, \
+    Optional
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most `maxsize` entries. When full, the
+    least recently used entry is evicted to make room for a new one. Hits,
+    misses and evictions are counted to allow judging whether the cache is
+    sized properly.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def resize(self, maxsize: int):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def key_digest(key: str) -> bytes:
+    """
+    Returns the fixed-size digest which BloomFilter derives the bit positions
+    of the given key from.
+    """
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter(object):
+    """
+    A space-efficient set of strings that may report false positives (with
+    probability `error_rate` as long as at most `capacity` strings were added)
+    but never false negatives. Strings may also be added by their `key_digest`.
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        self.num_bits = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(
+            1, round(self.num_bits / max(capacity, 1) * math.log(2)))
+
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _bit_positions(self, digest: bytes) -> Iterator[int]:
+        # double hashing: two 64 bit halves of one digest yield all positions
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        self.add_digest(key_digest(key))
+
+    def add_digest(self, digest: bytes):
+        with self._lock:
+            for pos in self._bit_positions(digest):
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._bit_positions(key_digest(key)))
+
+
+class NegativeLookupFilter(object):
+    """
+    Keeps a BloomFilter over all keys known to exist, e.g. in the database, so
+    that lookups of keys that do not exist can be answered without asking the
+    database. The Bloom filter is only consulted once it was populated
+    completely via `rebuild`; until then, and after `invalidate`, every key
+    is reported as possibly existing.
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.enabled = False
+        self.definite_misses = 0
+
+        self._bloom_filter: Optional[BloomFilter] = None
+
+    def rebuild(self, keys: Iterable[str]):
+        """
+        Replaces the Bloom filter by one populated with the given keys. Keys
+        added via `add` while rebuilding are not retained, so callers have to
+        make sure they are part of `keys` or added again afterwards.
+        """
+        self._bloom_filter = None
+        bloom_filter = BloomFilter(self.capacity, self.error_rate)
+
+        for key in keys:
+            bloom_filter.add(key)
+
+        self._bloom_filter = bloom_filter
+
+    def invalidate(self):
+        self._bloom_filter = None
+
+    def add(self, key: str):
+        self.add_digest(key_digest(key))
+
+    def add_digest(self, digest: bytes):
+        bloom_filter = self._bloom_filter
+
+        if bloom_filter is not None:
+            bloom_filter.add_digest(digest)
+
+    def might_contain(self, key: str) -> bool:
+        bloom_filter = self._bloom_filter
+
+        if bloom_filter is None or key in bloom_filter:
+            return True
+
+        self.definite_misses += 1
+
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'ready': self._bloom_filter is not None,
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'definite_misses': self.definite_misses,
+        }
+
+
+class Snapshot(object):
+    """
+    An in-process copy of rarely changing data. The copy is built by the
+    loader passed to `get` on first use and rebuilt once `invalidate` was
+    called, which bumps `version`, or once it is older than `max_age`
+    seconds, which bounds its staleness should an invalidation get lost.
+    """
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.version = 0
+
+        self._value = None
+        self._value_version: Optional[int] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def get(self, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            version = self.version
+            loaded_at = time.monotonic()
+
+            if self._value_version == version \
+                    and loaded_at - self._loaded_at < self.max_age:
+                return self._value
+
+        value = load()
+
+        with self._lock:
+            # a concurrent load may have built a copy of a newer version
+            if self._value_version is None or self._value_version <= version:
+                self._value = value
+                self._value_version = version
+                self._loaded_at = loaded_at
+
+        return value
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+
+class WriteCoalescer(object):
+    """
+    Collects the items submitted by concurrent callers and hands them to
+    `flush` in batches, so that e.g. many registrations are written in one
+    transaction and share a single commit. A batch is flushed once it holds
+    `max_batch_size` items or `window` seconds after its first item was
+    submitted, whichever comes first.
+
+    `flush` is called in a worker thread with the list of items of a batch
+    and has to return a list holding the result of each item in the same
+    order. Results which are exceptions are raised to the respective caller
+    only; if `flush` raises, all callers of the batch get the exception.
+    """
+    def __init__(
+            self,
+            flush: Callable[[List[Any]], List[Any]],
+            window: float,
+            max_batch_size: int):
+
+        self.window = window
+        self.max_batch_size = max_batch_size
+
+        self._flush_batch = flush
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        # number of batches by batch size, rounded up to a power of two
+        self._batch_sizes: Dict[int, int] = {}
+        self._stats_lock = threading.Lock()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Adds the given item to the current batch and returns its result once
+        the batch was flushed.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush_pending)
+
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'window': self.window,
+                'max_batch_size': self.max_batch_size,
+                'batches': self._batches,
+                'items': self._items,
+                'largest_batch': self._largest_batch,
+                'mean_batch_size':
+                    self._items / self._batches if self._batches else 0.0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+            }
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = self._pending
+        self._pending = []
+
+        if batch:
+            asyncio.ensure_future(self._flush(batch))
+
+    async def _flush(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self._record_batch(len(batch))
+
+        try:
+            results = await run_in_threadpool(
+                self._flush_batch, [item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            # the caller may have gone away in the meantime
+            if future.done():
+                continue
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _record_batch(self, batch_size: int):
+        bucket = 1
+
+        while bucket < batch_size:
+            bucket *= 2
+
+        with self._stats_lock:
+            self._batches += 1
+            self._items += batch_size
+            self._largest_batch = max(self._largest_batch, batch_size)
+            self._batch_sizes[bucket] = self._batch_sizes.get(bucket, 0) + 1
@@ -1,8 +1,21 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import io
+import itertools
+import logging
+import select
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
 
 import ompid
 
+logger = logging.getLogger(__name__)
+
 
 def build_postgresql_url(settings):
     pg_settings = settings['postgresql']
@@ -12,10 +25,310 @@ def build_postgresql_url(settings):
         f'/{pg_settings["db"]}'
 
 
-engine = create_engine(
-    build_postgresql_url(ompid.load_default_configuration()),
-    echo=True)
+def build_replica_urls(settings) -> List[str]:
+    """
+    Returns the URLs of the read replicas configured in the
+    postgresql_replicas list. Connection settings not given for a replica are
+    taken from the primary's settings.
+    """
+    return [
+        build_postgresql_url(
+            {'postgresql': {**settings['postgresql'], **replica_settings}})
+        for replica_settings in settings.get('postgresql_replicas') or []]
+
+
+# Idempotent DDL statements bringing databases created by earlier versions of
+# the service up to date. Fresh databases get the same schema objects from
+# Base.metadata.create_all, so every statement here has to be a no-op on them.
+SCHEMA_UPGRADES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_topio_asset_owner_type_local_id '
+    'ON topio_asset (owner_id, asset_type, local_id)',
+
+    # topio IDs used to be computed on the fly; they are stored since then
+    'ALTER TABLE topio_asset ADD COLUMN IF NOT EXISTS topio_id VARCHAR',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_topio_asset_topio_id '
+    'ON topio_asset (topio_id)',
+    "UPDATE topio_asset "
+    "SET topio_id = 'topio.' || topio_user.user_namespace || '.' || "
+    "    topio_asset.id || '.' || topio_asset.asset_type "
+    "FROM topio_user "
+    "WHERE topio_user.id = topio_asset.owner_id "
+    "AND topio_asset.topio_id IS NULL",
+
+    'CREATE INDEX IF NOT EXISTS ix_topio_asset_owner_id_id '
+    'ON topio_asset (owner_id, id)',
+]
+
+
+def upgrade_schema(db_engine):
+    """
+    Applies all SCHEMA_UPGRADES in one transaction.
+
+    :param db_engine: the engine of the database to upgrade
+    """
+    with db_engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+
+
+# Sends one notification per payload; the payloads are bound as one array
+NOTIFY_STATEMENT = text(
+    'SELECT pg_notify(:channel, payload) '
+    'FROM unnest(CAST(:payloads AS TEXT[])) AS payload')
+
+
+def notify(db: Session, channel: str, payloads: List[str]):
+    """
+    Sends PostgreSQL notifications on the given channel as part of the
+    session's transaction, i.e. they are only delivered (to every listening
+    connection, including those of this process) once the transaction is
+    committed. Each payload must be shorter than 8000 bytes.
+    """
+    if payloads:
+        db.execute(NOTIFY_STATEMENT, {'channel': channel, 'payloads': payloads})
+
+
+def _copy_text_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+
+    return str(value)\
+        .replace('\\', '\\\\')\
+        .replace('\t', '\\t')\
+        .replace('\n', '\\n')\
+        .replace('\r', '\\r')
+
+
+def copy_rows(
+        db: Session,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[Sequence[Any]]):
+    """
+    Loads the given rows into the given table with COPY ... FROM STDIN as part
+    of the session's transaction. Compared to INSERT statements, this saves
+    parsing and planning per row and sends all rows in one stream.
+
+    :param db: the session whose transaction the rows are loaded in
+    :param table: the name of the table to load the rows into
+    :param columns: the names of the columns the row values are loaded into
+    :param rows: the rows, each a sequence of values in the order of columns;
+        None values are loaded as NULL
+    """
+    data = io.StringIO()
+
+    for row in rows:
+        data.write('\t'.join(_copy_text_value(value) for value in row))
+        data.write('\n')
+
+    data.seek(0)
+
+    with db.connection().connection.cursor() as cur:
+        cur.copy_expert(
+            f'COPY {table} ({", ".join(columns)}) FROM STDIN', data)
+
+
+class NotificationListener(threading.Thread):
+    """
+    Listens for PostgreSQL notifications on a dedicated connection and hands
+    their payloads to the callbacks subscribed to the respective channel.
+    Whenever the connection is (re-)established, the on-connect callbacks are
+    run after LISTEN took effect, so they can rebuild any state that is kept
+    up to date via notifications without missing one in between.
+    """
+    def __init__(
+            self,
+            db_engine: Engine,
+            poll_timeout: float = 5.0,
+            reconnect_delay: float = 1.0):
+
+        super().__init__(name='ompid-notification-listener', daemon=True)
+
+        self._engine = db_engine
+        self._poll_timeout = poll_timeout
+        self._reconnect_delay = reconnect_delay
+        self._channel_callbacks: Dict[str, List[Callable[[str], None]]] = {}
+        self._connect_callbacks: List[Callable[[], None]] = []
+        self._stopped = threading.Event()
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        self._channel_callbacks.setdefault(channel, []).append(callback)
+
+    def has_subscriptions(self) -> bool:
+        return bool(self._channel_callbacks)
+
+    def on_connect(self, callback: Callable[[], None]):
+        self._connect_callbacks.append(callback)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception(
+                    'Listening for notifications failed, reconnecting')
+                self._stopped.wait(self._reconnect_delay)
+
+    def _listen(self):
+        conn = self._engine.raw_connection()
+        # the connection is held for the lifetime of the listener and must not
+        # block a slot of the engine's pool
+        conn.detach()
+        dbapi_conn = conn.connection
+
+        try:
+            dbapi_conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+            with dbapi_conn.cursor() as cur:
+                for channel in self._channel_callbacks:
+                    cur.execute(f'LISTEN {channel}')
+
+            for callback in self._connect_callbacks:
+                callback()
+
+            while not self._stopped.is_set():
+                readable, _, _ = \
+                    select.select([dbapi_conn], [], [], self._poll_timeout)
+
+                if not readable:
+                    # detect connections that died silently
+                    with dbapi_conn.cursor() as cur:
+                        cur.execute('SELECT 1')
+                    continue
+
+                dbapi_conn.poll()
+
+                while dbapi_conn.notifies:
+                    notification = dbapi_conn.notifies.pop(0)
+                    self._dispatch(notification.channel, notification.payload)
+        finally:
+            conn.close()
+
+    def _dispatch(self, channel: str, payload: str):
+        for callback in self._channel_callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception(
+                    f'Handling notification on channel {channel} failed')
+
+
+class _ReplicaSession(Session):
+    """
+    A session which connects to a replica picked by its ReplicaRouter on first
+    use instead of being bound to one up front.
+    """
+    def __init__(self, router: 'ReplicaRouter', **kwargs):
+        super().__init__(**kwargs)
+
+        self._router = router
+        self._replica_connection: Optional[Connection] = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._replica_connection is None:
+            self._replica_connection = self._router.connect()
+
+        return self._replica_connection
+
+    def close(self):
+        super().close()
+
+        # connections given as bind are not closed by the session itself
+        if self._replica_connection is not None:
+            self._replica_connection.close()
+            self._replica_connection = None
+
+
+class ReplicaRouter(object):
+    """
+    Hands out sessions for read-only work, connected to the read replicas in
+    round-robin order. Sessions only connect once they are used, so requests
+    answered without querying don't cost a connection checkout. A replica
+    which can't be connected to is skipped for `retry_interval` seconds, and
+    the session connects to the next available replica instead, or to the
+    primary if there is none.
+
+    Replicas may lag behind the primary, so reads routed to them are not
+    guaranteed to see writes which were just committed.
+    """
+    def __init__(
+            self,
+            session_factory: sessionmaker,
+            replicas: List[Engine],
+            retry_interval: float = 30.0):
+
+        self.retry_interval = retry_interval
+
+        self._session_factory = session_factory
+        self._replicas = replicas
+        self._next_replica = itertools.cycle(range(len(replicas)))
+        self._unavailable_until: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _available_replicas(self) -> List[int]:
+        """
+        Returns the available replicas, starting with the next one in
+        round-robin order.
+        """
+        if not self._replicas:
+            return []
+
+        now = time.monotonic()
+
+        with self._lock:
+            first_replica = next(self._next_replica)
+
+            return [
+                replica
+                for replica in (
+                    (first_replica + i) % len(self._replicas)
+                    for i in range(len(self._replicas)))
+                if self._unavailable_until.get(replica, 0) <= now]
+
+    def _mark_unavailable(self, replica: int):
+        logger.warning(
+            f'Read replica {self._replicas[replica].url!r} is unavailable, '
+            f'skipping it for {self.retry_interval} seconds')
+
+        with self._lock:
+            self._unavailable_until[replica] = \
+                time.monotonic() + self.retry_interval
+
+    def connect(self) -> Connection:
+        """
+        Returns a connection to the next available replica, or to the primary
+        if no replica can be connected to.
+        """
+        for replica in self._available_replicas():
+            try:
+                # the replica engines ping pooled connections on checkout
+                return self._replicas[replica].connect()
+            except OperationalError:
+                self._mark_unavailable(replica)
+
+        return self._session_factory.kw['bind'].connect()
+
+    def session(self) -> Session:
+        if not self._replicas:
+            return self._session_factory()
+
+        return _ReplicaSession(self, **self._session_factory.kw)
+
+
+settings = ompid.load_default_configuration()
+
+engine = create_engine(build_postgresql_url(settings), echo=True)
 
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+replica_router = ReplicaRouter(
+    SessionLocal,
+    [
+        create_engine(url, pool_pre_ping=True)
+        for url in build_replica_urls(settings)
+    ],
+    (settings.get('replica_routing') or {}).get('retry_interval', 30.0))
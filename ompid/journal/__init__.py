@@ -0,0 +1,250 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.jsonl'
+LOCK_SUFFIX = '.lock'
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_segment(path: str) -> List[Dict[str, Any]]:
+    """
+    Returns the records of the given journal segment. A last line which is
+    not valid JSON was torn by a crash while being appended; as its append
+    never completed, it was not acknowledged and is skipped.
+    """
+    with open(path, 'rb') as segment_file:
+        lines = segment_file.read().splitlines()
+
+    records = []
+
+    for line_number, line in enumerate(lines, 1):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            if line_number < len(lines):
+                raise
+
+            logger.warning(
+                f'Skipping torn last record of journal segment {path}')
+
+    return records
+
+
+class WriteBehindJournal(object):
+    """
+    A local append-only journal of records which are written to the database
+    later. `append` returns once the records are fsynced, so they survive a
+    crash of the process or the machine. A flusher thread closes the current
+    segment file every `flush_interval` seconds and hands the records of all
+    closed segments to `flush`, oldest segment first; segments are deleted
+    once `flush` returned. `flush` may thus be called with records it has
+    already written before a crash and has to be idempotent.
+
+    Several processes can share the journal directory: each one claims a slot
+    subdirectory, which is guarded by an exclusive lock on `<slot>.lock` for
+    the lifetime of the process. On `start`, segments left by processes that
+    didn't stop cleanly are flushed first: those of the claimed slot and
+    those of every other slot which no running process holds the lock of,
+    e.g. because fewer processes were started than before a crash.
+    """
+    def __init__(
+            self,
+            directory: str,
+            flush: Callable[[List[Dict[str, Any]]], None],
+            flush_interval: float = 1.0):
+
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+        self._flush_records = flush
+        self._slot_directory: Optional[str] = None
+        self._slot_lock_file = None
+        self._segment_file = None
+        self._segment_number = 0
+        self._segment_records = 0
+        self._append_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._claim_slot()
+
+        # crash recovery
+        self.flush_segments()
+        self._flush_unclaimed_slots()
+
+        self._open_segment()
+
+        self._flusher = threading.Thread(
+            target=self._run, name='ompid-journal-flusher', daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """
+        Stops the flusher thread and flushes all records appended so far.
+        """
+        self._stopped.set()
+
+        if self._flusher is not None:
+            self._flusher.join()
+
+        with self._append_lock:
+            self._segment_file.close()
+            self._segment_file = None
+
+        self.flush_segments()
+
+        self._slot_lock_file.close()
+
+    def append(self, records: List[Dict[str, Any]]):
+        data = ''.join(
+            json.dumps(record, separators=(',', ':')) + '\n'
+            for record in records).encode('utf-8')
+
+        with self._append_lock:
+            self._segment_file.write(data)
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+            self._segment_records += len(records)
+
+    def pending_segments(self) -> List[str]:
+        """
+        Returns the paths of the segments of the claimed slot which are not
+        appended to anymore and wait to be flushed, oldest first.
+        """
+        return [
+            self._segment_path(self._slot_directory, segment_number)
+            for segment_number in self._segment_numbers(self._slot_directory)
+            if self._segment_file is None
+            or segment_number != self._segment_number]
+
+    def flush_segments(self):
+        with self._flush_lock:
+            self._flush_segment_files(self.pending_segments())
+
+    def _flush_segment_files(self, paths: List[str]):
+        for path in paths:
+            records = read_segment(path)
+
+            if records:
+                self._flush_records(records)
+
+            os.remove(path)
+
+    def _lock_slot(self, slot: str):
+        """
+        Returns the opened lock file of the given slot, locked exclusively, or
+        None if another process holds the lock. Closing the file releases the
+        lock.
+        """
+        lock_file = open(
+            os.path.join(self.directory, f'{slot}{LOCK_SUFFIX}'), 'a')
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+
+        return lock_file
+
+    def _claim_slot(self):
+        slot = 0
+
+        while True:
+            lock_file = self._lock_slot(str(slot))
+
+            if lock_file is not None:
+                break
+
+            slot += 1
+
+        self._slot_lock_file = lock_file
+        self._slot_directory = os.path.join(self.directory, str(slot))
+        os.makedirs(self._slot_directory, exist_ok=True)
+
+    def _flush_unclaimed_slots(self):
+        slots = [
+            file_name[:-len(LOCK_SUFFIX)]
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith(LOCK_SUFFIX)]
+
+        for slot in slots:
+            slot_directory = os.path.join(self.directory, slot)
+
+            if slot_directory == self._slot_directory \
+                    or not os.path.isdir(slot_directory):
+                continue
+
+            lock_file = self._lock_slot(slot)
+
+            # the slot is claimed by a running process
+            if lock_file is None:
+                continue
+
+            try:
+                with self._flush_lock:
+                    self._flush_segment_files([
+                        self._segment_path(slot_directory, segment_number)
+                        for segment_number
+                        in self._segment_numbers(slot_directory)])
+            finally:
+                lock_file.close()
+
+    @staticmethod
+    def _segment_numbers(slot_directory: str) -> List[int]:
+        return sorted(
+            int(file_name[:-len(SEGMENT_SUFFIX)])
+            for file_name in os.listdir(slot_directory)
+            if file_name.endswith(SEGMENT_SUFFIX))
+
+    @staticmethod
+    def _segment_path(slot_directory: str, segment_number: int) -> str:
+        return os.path.join(
+            slot_directory, f'{segment_number:020d}{SEGMENT_SUFFIX}')
+
+    def _open_segment(self):
+        self._segment_number = max(
+            self._segment_numbers(self._slot_directory)
+            + [self._segment_number]) + 1
+
+        self._segment_file = open(
+            self._segment_path(self._slot_directory, self._segment_number),
+            'ab')
+        self._segment_records = 0
+
+        # makes the new segment file itself survive a crash
+        _fsync_directory(self._slot_directory)
+
+    def _rotate(self):
+        with self._append_lock:
+            if self._segment_records == 0:
+                return
+
+            self._segment_file.close()
+            self._open_segment()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self._rotate()
+                self.flush_segments()
+            except Exception:
+                logger.exception(
+                    'Flushing the write-behind journal failed, retrying')
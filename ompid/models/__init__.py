@@ -1,12 +1,12 @@
 import re
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import pydantic
 from pydantic import validator
-from sqlalchemy import Column, ForeignKey, func
-from sqlalchemy import select
+from sqlalchemy import Column, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import column_property, ColumnProperty
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import Integer, String
 
 Base = declarative_base()
@@ -15,19 +15,60 @@ Base = declarative_base()
 TOPIO_ID_SCHEMA = 'topio.{owner_namespace}.{asset_id}.{asset_type}'
 
 
-def topio_id_to_parts(topio_id: str) -> Tuple[int, str, str]:
-    _, owner_ns, asset_id, asset_type = topio_id.split('.')
-    asset_id = int(asset_id)
-    return asset_id, asset_type, owner_ns
+# Namespaces and asset types only exclude whitespace, so they may contain dots
+# and even `.<digits>.` parts themselves. Such topio IDs can't be split
+# unambiguously without knowing the namespace or the asset type, e.g.
+# topio.a.1.b.2.file may be asset 1 of namespace a or asset 2 of namespace
+# a.1.b.
+TOPIO_ID_PATTERN = re.compile(
+    r'topio\.(?P<owner_namespace>\S+?)\.(?P<asset_id>\d+)\.(?P<asset_type>\S+)')
+
+# matches at every dot followed by an all-digit part, a dot and an asset type
+TOPIO_ID_SPLIT_PATTERN = re.compile(r'(?=\.(\d+)\.\S)')
+
+
+def topio_id_to_candidate_parts(topio_id: str) -> List[Tuple[int, str, str]]:
+    """
+    Returns every way to split a topio ID into its parts, without any database
+    access. There is more than one only if the namespace or the asset type
+    contains `.<digits>.` parts. The split with the shortest namespace comes
+    first.
+
+    :param topio_id: a topio ID following the TOPIO_ID_SCHEMA
+    :return: a list of tuples, each containing the asset ID, the asset type
+        and the owner namespace
+    :raises ValueError: if the given string is not a well-formed topio ID
+    """
+    if TOPIO_ID_PATTERN.fullmatch(topio_id) is None:
+        raise ValueError(f'Malformed topio ID {topio_id}')
 
+    rest = topio_id[len('topio.'):]
+
+    return [
+        (int(match.group(1)), rest[match.end(1) + 1:], rest[:match.start()])
+        for match in TOPIO_ID_SPLIT_PATTERN.finditer(rest)
+        if match.start() > 0]
+
+
+def topio_id_to_parts(topio_id: str) -> Tuple[int, str, str]:
+    """
+    Splits a topio ID into its parts without any database access. If the
+    split is ambiguous (see topio_id_to_candidate_parts), the one with the
+    shortest namespace is returned.
+
+    :param topio_id: a topio ID following the TOPIO_ID_SCHEMA
+    :return: a tuple containing the asset ID, the asset type and the owner
+        namespace
+    :raises ValueError: if the given string is not a well-formed topio ID
+    """
+    return topio_id_to_candidate_parts(topio_id)[0]
 
-def build_topio_id_column_property(
-        owner_namespace: ColumnProperty,
-        asset_id: int,
-        asset_type: str):
 
-    return 'topio.' + owner_namespace.expression + '.' + \
-        func.cast(asset_id, String) + '.' + asset_type
+def build_topio_id(owner_namespace: str, asset_id: int, asset_type: str) -> str:
+    return TOPIO_ID_SCHEMA.format(
+        owner_namespace=owner_namespace,
+        asset_id=asset_id,
+        asset_type=asset_type)
 # -----------------------------------------------------------------------------
 
 
@@ -117,6 +158,16 @@ class TopioAssetORM(Base):
     identifiers.
     """
     __tablename__ = 'topio_asset'
+    __table_args__ = (
+        # forward resolution (owner, type, local ID) -> topio ID; a local ID
+        # may only be registered once per owner and asset type
+        Index(
+            'ix_topio_asset_owner_type_local_id',
+            'owner_id', 'asset_type', 'local_id',
+            unique=True),
+        # keyset pagination over the assets of an owner
+        Index('ix_topio_asset_owner_id_id', 'owner_id', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     local_id = Column(String)
@@ -124,12 +175,28 @@ class TopioAssetORM(Base):
     asset_type = Column(String, ForeignKey('topio_asset_type.id'))
     description = Column(String)
 
-    owner_namespace = column_property(
-        select([TopioUserORM.user_namespace])
-        .where(TopioUserORM.id == owner_id).as_scalar())
+    # Stored at registration time (topio IDs never change once minted) so that
+    # reverse lookups are index probes instead of evaluating the topio ID
+    # concatenation for every row
+    topio_id = Column(String, unique=True, index=True)
+
+    # Loaded with a join on topio_user instead of a correlated subquery per
+    # asset row
+    owner = relationship(TopioUserORM, lazy='joined')
+
+    @hybrid_property
+    def owner_namespace(self) -> Optional[str]:
+        return self.owner.user_namespace if self.owner is not None else None
 
-    topio_id = column_property(
-        build_topio_id_column_property(owner_namespace, id, asset_type))
+    @owner_namespace.expression
+    def owner_namespace(cls):
+        # only usable in queries joining topio_user
+        return TopioUserORM.user_namespace
+
+
+# The sequence backing the serial topio_asset.id column. Asset IDs are drawn
+# from it explicitly before the insert since they are part of the topio ID.
+TOPIO_ASSET_ID_SEQUENCE = 'topio_asset_id_seq'
 
 
 class TopioAssetCreate(pydantic.BaseModel):
@@ -139,6 +206,16 @@ class TopioAssetCreate(pydantic.BaseModel):
     description: Optional[str] = None
 
 
+class TopioAssetKey(pydantic.BaseModel):
+    """
+    The attributes identifying an asset for the forward resolution to its
+    topio ID
+    """
+    owner_id: int
+    asset_type: str
+    local_id: str
+
+
 class TopioAsset(TopioAssetCreate):
     id: int
     topio_id: str
@@ -0,0 +1,27 @@
+from pytest_postgresql.compat import connection
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ompid.allocation import IdBlockAllocator
+
+
+def test_id_block_allocator(postgresql: connection):
+    engine = create_engine(
+        name_or_url='postgresql://',
+        connect_args=postgresql.get_dsn_parameters())
+    engine.execute('CREATE SEQUENCE test_id_seq')
+
+    db = sessionmaker(bind=engine)()
+    allocator = IdBlockAllocator('test_id_seq', block_size=10)
+
+    assert allocator.allocate(3, db) == [1, 2, 3]
+    assert allocator.allocate(7, db) == [4, 5, 6, 7, 8, 9, 10]
+
+    # the first block is used up; IDs drawn elsewhere are skipped
+    assert db.execute("SELECT nextval('test_id_seq')").scalar() == 11
+    assert allocator.allocate(1, db) == [12]
+
+    # allocations larger than a block draw as many IDs as needed
+    assert allocator.allocate(20, db) == list(range(13, 33))
+
+    db.close()
@@ -2,20 +2,27 @@ import json
 
 from pytest_postgresql.compat import connection, cursor
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 from starlette.testclient import TestClient
 
 import ompid
 import ompid.db
 from ompid import app, Base
+from ompid.cache import key_digest
+from ompid.journal import WriteBehindJournal
 from ompid.models import TOPIO_ID_SCHEMA
 
 
-def _init_test_client(postgresql: connection) -> TestClient:
-    mock_engine = create_engine(
+def _init_test_engine(postgresql: connection) -> Engine:
+    return create_engine(
         name_or_url='postgresql://',
         connect_args=postgresql.get_dsn_parameters())
 
+
+def _init_test_client(postgresql: connection) -> TestClient:
+    mock_engine = _init_test_engine(postgresql)
+
     async def get_mock_db():
         MockSessionLocal = \
             sessionmaker(autocommit=False, autoflush=False, bind=mock_engine)
@@ -27,11 +34,74 @@ def _init_test_client(postgresql: connection) -> TestClient:
             db.close()
 
     app.dependency_overrides[ompid.get_db] = get_mock_db
+    app.dependency_overrides[ompid.get_read_db] = get_mock_db
     Base.metadata.create_all(mock_engine)
 
+    # every test starts with an empty database, so entries cached by earlier
+    # tests would be stale
+    ompid.topio_id_cache.clear()
+    ompid.local_id_cache.clear()
+    ompid.users_cache.clear()
+    ompid.user_ids_cache.clear()
+    ompid.asset_id_allocator.clear()
+    ompid.pending_topio_ids.clear()
+    ompid.pending_local_ids.clear()
+    ompid.registered_assets_filter.invalidate()
+    ompid.asset_types_snapshot.invalidate()
+
     return TestClient(app)
 
 
+def test_upgrade_schema(postgresql: connection):
+    mock_engine = _init_test_engine(postgresql)
+    Base.metadata.create_all(mock_engine)
+
+    # upgrades have to be no-ops on an up-to-date schema and idempotent
+    ompid.db.upgrade_schema(mock_engine)
+    ompid.db.upgrade_schema(mock_engine)
+
+    cur: cursor = postgresql.cursor()
+    cur.execute(
+        f'SELECT indexname FROM pg_indexes WHERE tablename=%s;',
+        ('topio_asset',))
+    index_names = [row[0] for row in cur.fetchall()]
+    cur.close()
+
+    assert 'ix_topio_asset_owner_type_local_id' in index_names
+    assert 'ix_topio_asset_topio_id' in index_names
+
+    # a database of an earlier version without stored topio IDs should get
+    # them backfilled
+    cur: cursor = postgresql.cursor()
+    cur.execute('DROP INDEX ix_topio_asset_topio_id;')
+    cur.execute('ALTER TABLE topio_asset DROP COLUMN topio_id;')
+    cur.execute(
+        f'INSERT INTO topio_user (id, name, user_namespace) '
+        f'VALUES (%s, %s, %s);',
+        (1, 'User ABC', 'abc'))
+    cur.execute(
+        f'INSERT INTO topio_asset_type (id, description) VALUES (%s, %s);',
+        ('file', 'Data assets provided as downloadable file'))
+    cur.execute(
+        f'INSERT INTO topio_asset (id, local_id, owner_id, asset_type) '
+        f'VALUES (%s, %s, %s, %s);',
+        (23, 'hdfs://foo.bar.ttl', 1, 'file'))
+    postgresql.commit()
+    cur.close()
+
+    ompid.db.upgrade_schema(mock_engine)
+
+    cur: cursor = postgresql.cursor()
+    cur.execute(f'SELECT topio_id FROM topio_asset WHERE id=%s;', (23,))
+    results = cur.fetchall()
+    cur.close()
+
+    assert results[0][0] == TOPIO_ID_SCHEMA.format(**{
+        'owner_namespace': 'abc',
+        'asset_id': 23,
+        'asset_type': 'file'})
+
+
 def test_users_register(postgresql: connection):
     client = _init_test_client(postgresql)
 
@@ -63,6 +133,26 @@ def test_users_register(postgresql: connection):
 
     # no errors were raised
     assert response.status_code == 200
+    assert json.loads(response.content)['id'] == user_id
+
+    # namespace taken by another user ---------------------
+    response = client.post(
+        '/users/register',
+        json={'name': 'User XYZ', 'user_namespace': user_namespace})
+
+    assert response.status_code == 409
+
+    # name taken by another user --------------------------
+    response = client.post(
+        '/users/register',
+        json={'name': user_name, 'user_namespace': 'xyz'})
+
+    assert response.status_code == 409
+
+    cur: cursor = postgresql.cursor()
+    cur.execute('SELECT count(*) FROM topio_user;')
+    assert cur.fetchone()[0] == 1
+    cur.close()
 
     # user with broken namespace (contains whitespace) ----
     user_name = 'User DEF'
@@ -89,6 +179,79 @@ def test_users_register(postgresql: connection):
     assert len(results) == 0
 
 
+def test_users_register_bulk(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    response = client.post(
+        '/users/register',
+        json={'name': 'User ABC', 'user_namespace': 'abc'})
+    user_abc_id: int = json.loads(response.content)['id']
+
+    users = [
+        {'name': 'User XYZ', 'user_namespace': 'xyz'},
+        {'name': 'User ABC', 'user_namespace': 'abc'},
+        {'name': 'User DEF', 'user_namespace': 'def'},
+        {'name': 'User XYZ', 'user_namespace': 'xyz'},
+    ]
+
+    response = client.post('/users/register_bulk', json=users)
+
+    assert response.status_code == 200
+
+    user_ids = json.loads(response.content)
+
+    assert len(user_ids) == 4
+    assert user_ids[1] == user_abc_id
+    assert user_ids[0] == user_ids[3]
+    assert len(set(user_ids)) == 3
+
+    cur: cursor = postgresql.cursor()
+    cur.execute('SELECT id, name, user_namespace FROM topio_user ORDER BY id;')
+    results = cur.fetchall()
+    cur.close()
+
+    assert sorted(results) == sorted([
+        (user_abc_id, 'User ABC', 'abc'),
+        (user_ids[0], 'User XYZ', 'xyz'),
+        (user_ids[2], 'User DEF', 'def'),
+    ])
+
+    # if any namespace is taken by another user, no user is registered
+    response = client.post(
+        '/users/register_bulk',
+        json=[
+            {'name': 'User GHI', 'user_namespace': 'ghi'},
+            {'name': 'User JKL', 'user_namespace': 'abc'},
+        ])
+
+    assert response.status_code == 409
+
+    # if any name is taken by another user, no user is registered
+    response = client.post(
+        '/users/register_bulk',
+        json=[
+            {'name': 'User GHI', 'user_namespace': 'ghi'},
+            {'name': 'User ABC', 'user_namespace': 'jkl'},
+        ])
+
+    assert response.status_code == 409
+
+    # the whole batch is validated up front
+    response = client.post(
+        '/users/register_bulk',
+        json=[
+            {'name': 'User GHI', 'user_namespace': 'ghi'},
+            {'name': 'User JKL', 'user_namespace': 'this is broken'},
+        ])
+
+    assert response.status_code == 422
+
+    cur: cursor = postgresql.cursor()
+    cur.execute('SELECT count(*) FROM topio_user;')
+    assert cur.fetchone()[0] == 3
+    cur.close()
+
+
 def test_users_info(postgresql: connection):
     client = _init_test_client(postgresql)
 
@@ -112,6 +275,63 @@ def test_users_info(postgresql: connection):
     assert user_info_data['user_namespace'] == user_namespace
     assert user_info_data['id'] == user_id
 
+    etag = response.headers['ETag']
+    assert 'immutable' in response.headers['Cache-Control']
+
+    response = client.get(
+        f'/users/{user_id}',
+        headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+
+    # unknown user
+    response = client.get(f'/users/{user_id + 1}')
+
+    assert response.status_code == 404
+    assert 'immutable' not in response.headers['Cache-Control']
+
+
+def test_users_by_namespace(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    user_name = 'User ABC'
+    user_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': user_name, 'user_namespace': user_namespace})
+    user_id: int = json.loads(response.content)['id']
+
+    response = client.get(f'/users/by_namespace/{user_namespace}')
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == {
+        'name': user_name, 'user_namespace': user_namespace, 'id': user_id}
+
+    etag = response.headers['ETag']
+    assert 'immutable' in response.headers['Cache-Control']
+
+    response = client.get(
+        f'/users/by_namespace/{user_namespace}',
+        headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+
+    # the user is looked up in the database if it is not cached
+    ompid.users_cache.clear()
+    ompid.user_ids_cache.clear()
+
+    response = client.get(f'/users/by_namespace/{user_namespace}')
+
+    assert response.status_code == 200
+    assert json.loads(response.content)['id'] == user_id
+    assert ompid.user_ids_cache.get(user_namespace) == user_id
+
+    # unknown namespace
+    response = client.get('/users/by_namespace/xyz')
+
+    assert response.status_code == 404
+    assert 'immutable' not in response.headers['Cache-Control']
+
 
 def test_asset_types_register(postgresql: connection):
     client = _init_test_client(postgresql)
@@ -144,6 +364,21 @@ def test_asset_types_register(postgresql: connection):
 
     assert response.status_code == 200
 
+    # asset type ID taken with another description
+    response = client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': 'Another description'}
+    )
+
+    assert response.status_code == 409
+
+    cur: cursor = postgresql.cursor()
+    cur.execute(
+        f'SELECT description FROM topio_asset_type WHERE id=%s;',
+        (asset_type_id,))
+    assert cur.fetchall() == [(asset_type_description,)]
+    cur.close()
+
     # registration of asset type with broken asset type ID (contains spaces)
     asset_type_id = 'this is broken'
     asset_type_description = \
@@ -188,6 +423,16 @@ def test_asset_types_info(postgresql: connection):
     assert asset_info_data['id'] == asset_type_id
     assert asset_info_data['description'] == asset_type_description
 
+    response = client.get(
+        f'/asset_types/{asset_type_id}',
+        headers={'If-None-Match': response.headers['ETag']})
+
+    assert response.status_code == 304
+
+    response = client.get('/asset_types/foo')
+
+    assert response.status_code == 404
+
 
 def test_asset_types_list(postgresql: connection):
     client = _init_test_client(postgresql)
@@ -250,6 +495,23 @@ def test_asset_types_list(postgresql: connection):
     assert assets_list[2]['id'] == asset_type_3_id
     assert assets_list[2]['description'] == asset_type_3_description
 
+    etag = response.headers['ETag']
+
+    response = client.get('/asset_types/', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+
+    # registering an asset type invalidates the served snapshot
+    asset_type_4_id = 'service'
+
+    client.post('/asset_types/register', json={'id': asset_type_4_id})
+
+    response = client.get('/asset_types/', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(json.loads(response.content)) == 4
+
 
 def test_assets_register(postgresql: connection):
     client = _init_test_client(postgresql)
@@ -281,7 +543,7 @@ def test_assets_register(postgresql: connection):
             'asset_type': asset_type_id,
             'description': asset_1_description})
 
-    assert response.status_code == 200
+    assert response.status_code == 201
 
     # {
     #   "local_id":"hdfs://foo.bar.ttl",
@@ -315,12 +577,33 @@ def test_assets_register(postgresql: connection):
     assert results[0][3] == asset_type_id
     assert results[0][4] == asset_1_description
 
+    # registering the same local ID again for the same owner and asset type
+    # returns the registered asset
+    response = client.post(
+        '/assets/register',
+        json={
+            'local_id': asset_1_local_id,
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'description': asset_1_description})
+
+    assert response.status_code == 200
+    assert json.loads(response.content)['id'] == asset_1_id
+    assert json.loads(response.content)['topio_id'] == asset_1_topio_id
+
+    cur: cursor = postgresql.cursor()
+    cur.execute(
+        f'SELECT count(*) FROM topio_asset WHERE local_id=%s;',
+        (asset_1_local_id,))
+    assert cur.fetchone()[0] == 1
+    cur.close()
+
     # asset without local ID and description
     response = client.post(
         '/assets/register',
         json={'owner_id': owner_id, 'asset_type': asset_type_id})
 
-    assert response.status_code == 200
+    assert response.status_code == 201
 
     # {
     #   "local_id":null,
@@ -355,109 +638,654 @@ def test_assets_register(postgresql: connection):
     assert results[0][3] == asset_type_id
     assert results[0][4] is None
 
+    # unknown owner
+    response = client.post(
+        '/assets/register',
+        json={'owner_id': owner_id + 1, 'asset_type': asset_type_id})
+
+    assert response.status_code == 404
+
+    # unknown asset type
+    response = client.post(
+        '/assets/register',
+        json={'owner_id': owner_id, 'asset_type': 'unknown'})
+
+    assert response.status_code == 404
+
+
+def test_assets_register_journaled(
+        postgresql: connection, tmp_path, monkeypatch):
 
-def test_assets_topio_id(postgresql: connection):
     client = _init_test_client(postgresql)
 
-    # register asset owner
-    owner_name = 'User ABC'
-    owner_namespace = 'abc'
+    # the journal is flushed to the test database
+    monkeypatch.setattr(
+        ompid.db,
+        'SessionLocal',
+        sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=_init_test_engine(postgresql)))
+
     response = client.post(
         '/users/register',
-        json={'name': owner_name, 'user_namespace': owner_namespace})
+        json={'name': 'User ABC', 'user_namespace': 'abc'})
     owner_id = json.loads(response.content)['id']
 
-    # register asset type
     asset_type_id = 'file'
-    asset_type_description = 'Data assets provided as downloadable file'
-
     client.post(
         '/asset_types/register',
-        json={'id': asset_type_id, 'description': asset_type_description})
+        json={
+            'id': asset_type_id,
+            'description': 'Data assets provided as downloadable file'})
 
-    # This asset should be ignored by the get_topio_id method as it does not
-    # have a local ID. So local-ID-to-topio-ID doesn't make sense here.
-    client.post(
-        '/assets/register',
-        json={'owner_id': owner_id, 'asset_type': asset_type_id})
+    asset = {
+        'owner_id': owner_id,
+        'asset_type': asset_type_id,
+        'local_id': 'hdfs://foo.bar.ttl'}
 
-    # Asset with proper local ID which should be considered by the get_topio_id
-    # method
-    asset_2_local_id = 'hdfs://foo.bar.ttl'
-    asset_2_description = 'A Turtle HDFS file'
-    response = client.post(
-        '/assets/register',
-        json={
-            'owner_id': owner_id,
-            'asset_type': asset_type_id,
-            'local_id': asset_2_local_id,
-            'description': asset_2_description})
+    # write-behind registration is not enabled
+    response = client.post('/assets/register_journaled', json=asset)
 
-    asset_2_id = json.loads(response.content)['id']
-    del response
+    assert response.status_code == 503
 
-    # Calling /assets/topio_id with an undefined parameter
-    response = client.get(
-        '/assets/topio_id',
-        params={
-            'owner_id': owner_id,
-            'asset_type': asset_type_id,
-            'local_id': None})
+    # a long flush interval, so assets are only flushed on stop
+    journal = WriteBehindJournal(
+        str(tmp_path), ompid._flush_journaled_assets, 3600)
+    journal.start()
+    monkeypatch.setattr(ompid, 'registration_journal', journal)
 
-    # should cause a client error 422 (Unprocessable Entity)...
-    assert response.status_code == 422
+    try:
+        response = client.post('/assets/register_journaled', json=asset)
 
-    # Calling /assets/topio_id providing a local ID should return the correct
-    # result
-    response = client.get(
-        '/assets/topio_id',
-        params={
-            'owner_id': owner_id,
-            'asset_type': asset_type_id,
-            'local_id': asset_2_local_id})
+        assert response.status_code == 202
 
-    assert response.status_code == 200
+        asset_1_topio_id = json.loads(response.content)['topio_id']
 
-    returned_topio_id = json.loads(response.content)
+        assert asset_1_topio_id == TOPIO_ID_SCHEMA.format(**{
+            'owner_namespace': 'abc',
+            'asset_id': json.loads(response.content)['id'],
+            'asset_type': asset_type_id})
 
-    assert returned_topio_id == TOPIO_ID_SCHEMA.format(**{
-        'owner_namespace': owner_namespace,
-        'asset_id': asset_2_id,
-        'asset_type': asset_type_id})
+        # the asset is not in the database yet but can be resolved...
+        cur: cursor = postgresql.cursor()
+        cur.execute('SELECT count(*) FROM topio_asset;')
+        assert cur.fetchone()[0] == 0
+        cur.close()
 
-    # Calling /assets/topio_id for non-existent asset registration should
-    # return an error with 404 status code
+        response = client.get('/assets/topio_id', params=asset)
+
+        assert json.loads(response.content) == asset_1_topio_id
+
+        # ...though only briefly cached, as it may still be dropped
+        assert 'ETag' not in response.headers
+        assert 'immutable' not in response.headers['Cache-Control']
+
+        response = client.get(
+            f'/resolve/{asset_1_topio_id}', allow_redirects=False)
+
+        assert response.status_code == 302
+        assert response.headers['Location'] == asset['local_id']
+        assert 'immutable' not in response.headers['Cache-Control']
+
+        # it is returned when registered again before it is flushed
+        response = client.post('/assets/register_journaled', json=asset)
+
+        assert response.status_code == 202
+        assert json.loads(response.content)['topio_id'] == asset_1_topio_id
+
+        # unknown owner
+        response = client.post(
+            '/assets/register_journaled',
+            json={**asset, 'owner_id': owner_id + 1})
+
+        assert response.status_code == 404
+
+        # unknown asset type
+        response = client.post(
+            '/assets/register_journaled',
+            json={**asset, 'asset_type': 'unknown'})
+
+        assert response.status_code == 404
+
+        # an asset whose local ID gets registered before it is flushed
+        asset_2 = {**asset, 'local_id': 'hdfs://foo.baz.ttl'}
+        response = client.post('/assets/register_journaled', json=asset_2)
+
+        assert response.status_code == 202
+
+        asset_2_minted_topio_id = json.loads(response.content)['topio_id']
+        asset_2_topio_id = 'topio.abc.1000.file'
+
+        cur: cursor = postgresql.cursor()
+        cur.execute(
+            f'INSERT INTO topio_asset '
+            f'(id, local_id, owner_id, asset_type, topio_id) '
+            f'VALUES (%s, %s, %s, %s, %s);',
+            (1000, asset_2['local_id'], owner_id, asset_type_id,
+             asset_2_topio_id))
+        postgresql.commit()
+        cur.close()
+
+        # the registered asset takes precedence over the pending one
+        response = client.get('/assets/topio_id', params=asset_2)
+
+        assert json.loads(response.content) == asset_2_topio_id
+    finally:
+        journal.stop()
+
+    cur: cursor = postgresql.cursor()
+    cur.execute('SELECT topio_id, local_id FROM topio_asset ORDER BY id;')
+    assert cur.fetchall() == [
+        (asset_1_topio_id, asset['local_id']),
+        (asset_2_topio_id, asset_2['local_id'])]
+    cur.close()
+
+    assert ompid.pending_topio_ids == {}
+    assert ompid.pending_local_ids == {}
+
+    # the topio ID minted for the dropped asset can't be resolved anymore...
     response = client.get(
-        '/assets/topio_id',
-        params={
-            'owner_id': 0,
-            'asset_type': asset_type_id,
-            'local_id': asset_2_local_id})
+        '/assets/custom_id', json={'topio_id': asset_2_minted_topio_id})
 
     assert response.status_code == 404
-    assert response.content == b'No topio ID found for the given parameters'
 
+    # ...while the flushed asset is immutable now
+    response = client.get('/assets/topio_id', params=asset)
 
-def test_assets_custom_id(postgresql: connection):
+    assert json.loads(response.content) == asset_1_topio_id
+    assert 'immutable' in response.headers['Cache-Control']
+
+    ompid.topio_id_cache.clear()
+    ompid.local_id_cache.clear()
+
+    response = client.get(
+        '/assets/custom_id', json={'topio_id': asset_1_topio_id})
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == asset['local_id']
+    assert 'ETag' in response.headers
+
+
+def test_assets_register_bulk(postgresql: connection):
     client = _init_test_client(postgresql)
 
-    # register asset owner
-    owner_name = 'User ABC'
-    owner_namespace = 'abc'
+    # register asset owners
     response = client.post(
         '/users/register',
-        json={'name': owner_name, 'user_namespace': owner_namespace})
-    owner_id = json.loads(response.content)['id']
+        json={'name': 'User ABC', 'user_namespace': 'abc'})
+    owner_1_id = json.loads(response.content)['id']
+
+    response = client.post(
+        '/users/register',
+        json={'name': 'User DEF', 'user_namespace': 'def'})
+    owner_2_id = json.loads(response.content)['id']
 
     # register asset type
     asset_type_id = 'file'
-    asset_type_description = 'Data assets provided as downloadable file'
-
     client.post(
         '/asset_types/register',
-        json={'id': asset_type_id, 'description': asset_type_description})
+        json={
+            'id': asset_type_id,
+            'description': 'Data assets provided as downloadable file'})
+
+    assets = [
+        {
+            'owner_id': owner_1_id,
+            'asset_type': asset_type_id,
+            'local_id': 'hdfs://foo.bar.ttl',
+            'description': 'A Turtle HDFS file',
+        },
+        {
+            'owner_id': owner_2_id,
+            'asset_type': asset_type_id,
+            # characters which have to be escaped for COPY
+            'local_id': 'file:///tmp/a\tb\\c\nd',
+        },
+        {'owner_id': owner_1_id, 'asset_type': asset_type_id},
+    ]
+
+    response = client.post('/assets/register_bulk', json=assets)
+
+    assert response.status_code == 201
+
+    topio_ids = json.loads(response.content)
+
+    assert len(topio_ids) == 3
+    assert topio_ids[0].startswith('topio.abc.')
+    assert topio_ids[1].startswith('topio.def.')
+    assert topio_ids[2].startswith('topio.abc.')
+
+    cur: cursor = postgresql.cursor()
+    cur.execute(
+        'SELECT topio_id, local_id, owner_id, description FROM topio_asset '
+        'ORDER BY id;')
+    results = cur.fetchall()
+    cur.close()
+
+    assert sorted(results) == sorted([
+        (topio_ids[0], assets[0]['local_id'], owner_1_id,
+         assets[0]['description']),
+        (topio_ids[1], assets[1]['local_id'], owner_2_id, None),
+        (topio_ids[2], None, owner_1_id, None),
+    ])
+
+    # registered assets can be resolved right away
+    response = client.post(
+        '/assets/topio_ids/resolve',
+        json=[
+            {k: asset[k] for k in ('owner_id', 'asset_type', 'local_id')}
+            for asset in assets[:2]])
+
+    assert json.loads(response.content) == topio_ids[:2]
+
+    # if any asset is registered already, none is registered
+    new_asset = {
+        'owner_id': owner_1_id,
+        'asset_type': asset_type_id,
+        'local_id': 'hdfs://new.ttl'}
+
+    response = client.post(
+        '/assets/register_bulk', json=[new_asset, assets[0]])
+
+    assert response.status_code == 409
+
+    # unknown owner
+    response = client.post(
+        '/assets/register_bulk',
+        json=[new_asset, {**new_asset, 'owner_id': owner_2_id + 1}])
+
+    assert response.status_code == 404
+
+    # unknown asset type
+    response = client.post(
+        '/assets/register_bulk',
+        json=[new_asset, {**new_asset, 'asset_type': 'unknown'}])
+
+    assert response.status_code == 404
+
+    cur: cursor = postgresql.cursor()
+    cur.execute('SELECT count(*) FROM topio_asset;')
+    assert cur.fetchone()[0] == 3
+    cur.close()
+
+    response = client.post('/assets/register_bulk', json=[])
+
+    assert response.status_code == 201
+    assert json.loads(response.content) == []
+
+
+def test_assets_import(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    response = client.post(
+        '/users/register',
+        json={'name': 'User ABC', 'user_namespace': 'abc'})
+    owner_id = json.loads(response.content)['id']
+
+    asset_type_id = 'file'
+    client.post(
+        '/asset_types/register',
+        json={
+            'id': asset_type_id,
+            'description': 'Data assets provided as downloadable file'})
 
-    # Asset without a local ID
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': 'hdfs://registered.ttl'})
+    registered_topio_id = json.loads(response.content)['topio_id']
+
+    lines = [
+        json.dumps({
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': 'hdfs://foo.bar.ttl',
+            'description': 'A Turtle HDFS file'}),
+        '',
+        json.dumps({'owner_id': owner_id, 'asset_type': asset_type_id}),
+        json.dumps({'owner_id': owner_id}),
+        json.dumps({'owner_id': owner_id + 1, 'asset_type': asset_type_id}),
+        json.dumps({'owner_id': owner_id, 'asset_type': 'unknown'}),
+        json.dumps({
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': 'hdfs://registered.ttl'}),
+    ]
+
+    response = client.post(
+        '/assets/import',
+        data='\n'.join(lines).encode('utf-8'),
+        headers={'Content-Type': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [result['line'] for result in results] == [1, 3, 4, 5, 6, 7]
+    assert results[0]['topio_id'].startswith('topio.abc.')
+    assert results[1]['topio_id'].startswith('topio.abc.')
+    assert results[2]['errors'][0]['loc'] == ['asset_type']
+    assert 'error' in results[3]
+    assert 'error' in results[4]
+    assert results[5]['topio_id'] == registered_topio_id
+
+    cur: cursor = postgresql.cursor()
+    cur.execute('SELECT topio_id FROM topio_asset;')
+    topio_ids = {topio_id for topio_id, in cur.fetchall()}
+    cur.close()
+
+    assert topio_ids == {
+        registered_topio_id, results[0]['topio_id'], results[1]['topio_id']}
+
+    # importing the same assets again returns the registered topio IDs
+    response = client.post('/assets/import', data=lines[0].encode('utf-8'))
+
+    assert json.loads(response.text) == results[0]
+
+
+def test_assets_topio_id(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    # This asset should be ignored by the get_topio_id method as it does not
+    # have a local ID. So local-ID-to-topio-ID doesn't make sense here.
+    client.post(
+        '/assets/register',
+        json={'owner_id': owner_id, 'asset_type': asset_type_id})
+
+    # Asset with proper local ID which should be considered by the get_topio_id
+    # method
+    asset_2_local_id = 'hdfs://foo.bar.ttl'
+    asset_2_description = 'A Turtle HDFS file'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id,
+            'description': asset_2_description})
+
+    asset_2_id = json.loads(response.content)['id']
+    del response
+
+    # Calling /assets/topio_id with an undefined parameter
+    response = client.get(
+        '/assets/topio_id',
+        params={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': None})
+
+    # should cause a client error 422 (Unprocessable Entity)...
+    assert response.status_code == 422
+
+    # Calling /assets/topio_id providing a local ID should return the correct
+    # result
+    response = client.get(
+        '/assets/topio_id',
+        params={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id})
+
+    assert response.status_code == 200
+
+    returned_topio_id = json.loads(response.content)
+
+    assert returned_topio_id == TOPIO_ID_SCHEMA.format(**{
+        'owner_namespace': owner_namespace,
+        'asset_id': asset_2_id,
+        'asset_type': asset_type_id})
+
+    # found topio IDs are immutable and may be cached forever...
+    etag = response.headers['ETag']
+    assert 'immutable' in response.headers['Cache-Control']
+
+    # ...and conditional requests are answered without a body
+    response = client.get(
+        '/assets/topio_id',
+        params={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id},
+        headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.content == b''
+
+    # Calling /assets/topio_id for non-existent asset registration should
+    # return an error with 404 status code
+    response = client.get(
+        '/assets/topio_id',
+        params={
+            'owner_id': 0,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id})
+
+    assert response.status_code == 404
+    assert response.content == b'No topio ID found for the given parameters'
+    assert response.headers['Cache-Control'] == \
+        f'public, max-age={ompid.DEFAULT_NOT_FOUND_MAX_AGE}'
+    assert 'ETag' not in response.headers
+
+
+def test_assets_topio_id_negative_lookup(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    # populate the registered assets filter from the (empty) table
+    ompid.registered_assets_filter.rebuild([])
+
+    try:
+        asset_1_local_id = 'hdfs://foo.bar.ttl'
+        response = client.post(
+            '/assets/register',
+            json={
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': asset_1_local_id})
+        asset_1_topio_id = json.loads(response.content)['topio_id']
+
+        # registered assets are added to the filter and can be resolved
+        ompid.topio_id_cache.clear()
+
+        response = client.get(
+            '/assets/topio_id',
+            params={
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': asset_1_local_id})
+
+        assert response.status_code == 200
+        assert json.loads(response.content) == asset_1_topio_id
+
+        # An asset inserted behind the service's back is not in the filter.
+        # That it is reported as not found shows that the database was not
+        # queried.
+        asset_2_local_id = 'hdfs://foo.baz.ttl'
+        cur: cursor = postgresql.cursor()
+        cur.execute(
+            f'INSERT INTO topio_asset '
+            f'(id, local_id, owner_id, asset_type, topio_id) '
+            f'VALUES (%s, %s, %s, %s, %s);',
+            (1000, asset_2_local_id, owner_id, asset_type_id,
+             'topio.abc.1000.file'))
+        postgresql.commit()
+        cur.close()
+
+        response = client.get(
+            '/assets/topio_id',
+            params={
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': asset_2_local_id})
+
+        assert response.status_code == 404
+
+        # registrations announced by other worker processes carry the digests
+        # of the keys, which are added to the filter
+        ompid._on_asset_registrations(','.join([
+            key_digest(ompid._asset_filter_key(
+                owner_id, asset_type_id, asset_2_local_id)).hex(),
+            key_digest(ompid._asset_filter_key(
+                owner_id, asset_type_id, 'x' * 10000)).hex()]))
+
+        response = client.get(
+            '/assets/topio_id',
+            params={
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': asset_2_local_id})
+
+        assert response.status_code == 200
+    finally:
+        ompid.registered_assets_filter.invalidate()
+
+    # without the filter the database is queried again
+    ompid.topio_id_cache.clear()
+
+    response = client.get(
+        '/assets/topio_id',
+        params={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id})
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == 'topio.abc.1000.file'
+
+
+def test_assets_topio_ids_resolve(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    asset_1_local_id = 'hdfs://foo.bar.ttl'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_1_local_id})
+    asset_1_topio_id = json.loads(response.content)['topio_id']
+
+    asset_2_local_id = 'hdfs://foo.baz.ttl'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id})
+    asset_2_topio_id = json.loads(response.content)['topio_id']
+
+    # asset 1 is resolved from the cache, asset 2 from the database
+    ompid.topio_id_cache.clear()
+    ompid.topio_id_cache.put(
+        (owner_id, asset_type_id, asset_1_local_id), asset_1_topio_id)
+
+    response = client.post(
+        '/assets/topio_ids/resolve',
+        json=[
+            {
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': asset_2_local_id},
+            {
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': 'hdfs://not/registered'},
+            {
+                'owner_id': owner_id,
+                'asset_type': asset_type_id,
+                'local_id': asset_1_local_id},
+            # an owner ID out of the range of the id column
+            {
+                'owner_id': 10 ** 12,
+                'asset_type': asset_type_id,
+                'local_id': asset_1_local_id},
+        ])
+
+    assert response.status_code == 200
+
+    # results are in request order with null for unregistered assets
+    assert json.loads(response.content) == \
+        [asset_2_topio_id, None, asset_1_topio_id, None]
+
+    # empty requests are fine
+    response = client.post('/assets/topio_ids/resolve', json=[])
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == []
+
+
+def test_assets_custom_id(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    # Asset without a local ID
     response = client.post(
         '/assets/register',
         json={'owner_id': owner_id, 'asset_type': asset_type_id})
@@ -507,6 +1335,205 @@ def test_assets_custom_id(postgresql: connection):
     returned_local_id = json.loads(response.content)
     assert returned_local_id == asset_2_local_id
 
+    etag = response.headers['ETag']
+
+    response = client.get(
+        '/assets/custom_id',
+        json={'topio_id': asset_2_topio_id},
+        headers={'If-None-Match': f'"foo", W/{etag}'})
+
+    assert response.status_code == 304
+
+    del response
+
+    # existing asset ID but wrong owner namespace
+    response = client.get(
+        '/assets/custom_id',
+        json={'topio_id': TOPIO_ID_SCHEMA.format(**{
+            'owner_namespace': 'xyz',
+            'asset_id': asset_2_id,
+            'asset_type': asset_type_id})})
+
+    assert response.status_code == 404
+
+    del response
+
+    # asset ID out of the range of the id column
+    response = client.get(
+        '/assets/custom_id',
+        json={'topio_id': 'topio.abc.99999999999.file'})
+
+    assert response.status_code == 404
+
+    del response
+
+    # malformed topio ID
+    response = client.get(
+        '/assets/custom_id',
+        json={'topio_id': 'topio.abc.file'})
+
+    assert response.status_code == 422
+
+
+def test_resolve(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    # Asset without a local ID
+    response = client.post(
+        '/assets/register',
+        json={'owner_id': owner_id, 'asset_type': asset_type_id})
+    asset_1_topio_id = json.loads(response.content)['topio_id']
+
+    asset_2_local_id = 'https://topio.market/data/foo.csv'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id})
+    asset_2_topio_id = json.loads(response.content)['topio_id']
+
+    response = client.get(
+        f'/resolve/{asset_2_topio_id}', allow_redirects=False)
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == asset_2_local_id
+    assert 'immutable' in response.headers['Cache-Control']
+
+    # as there is no local ID for asset 1
+    response = client.get(
+        f'/resolve/{asset_1_topio_id}', allow_redirects=False)
+
+    assert response.status_code == 404
+
+    # a namespace containing an all-digit part, so the topio ID can be split
+    # in more than one way
+    response = client.post(
+        '/users/register',
+        json={'name': 'User A1B', 'user_namespace': 'a.1.b'})
+    owner_2_id = json.loads(response.content)['id']
+
+    asset_3_local_id = 'https://topio.market/data/bar.csv'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_2_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_3_local_id})
+    asset_3_topio_id = json.loads(response.content)['topio_id']
+
+    assert asset_3_topio_id.startswith('topio.a.1.b.')
+
+    ompid.local_id_cache.clear()
+
+    response = client.get(
+        f'/resolve/{asset_3_topio_id}', allow_redirects=False)
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == asset_3_local_id
+
+    response = client.get(
+        '/resolve/topio.abc.99999999999.file', allow_redirects=False)
+
+    assert response.status_code == 404
+
+    response = client.get('/resolve/topio.abc.file', allow_redirects=False)
+
+    assert response.status_code == 422
+
+
+def test_assets_custom_ids_resolve(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    # Asset without a local ID
+    response = client.post(
+        '/assets/register',
+        json={'owner_id': owner_id, 'asset_type': asset_type_id})
+    asset_1_topio_id = json.loads(response.content)['topio_id']
+
+    asset_2_local_id = 'hdfs://foo.bar.ttl'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_2_local_id})
+    asset_2_id = json.loads(response.content)['id']
+    asset_2_topio_id = json.loads(response.content)['topio_id']
+
+    asset_3_local_id = 'hdfs://foo.baz.ttl'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_3_local_id})
+    asset_3_topio_id = json.loads(response.content)['topio_id']
+
+    # asset 3 is resolved from the cache, all others from the database
+    ompid.local_id_cache.clear()
+    ompid.local_id_cache.put(asset_3_topio_id, asset_3_local_id)
+
+    wrong_namespace_topio_id = TOPIO_ID_SCHEMA.format(**{
+        'owner_namespace': 'xyz',
+        'asset_id': asset_2_id,
+        'asset_type': asset_type_id})
+
+    # an asset ID out of the range of the id column
+    out_of_range_topio_id = 'topio.abc.99999999999.file'
+
+    response = client.post(
+        '/assets/custom_ids/resolve',
+        json=[
+            asset_3_topio_id,
+            asset_1_topio_id,
+            wrong_namespace_topio_id,
+            asset_2_topio_id,
+            out_of_range_topio_id])
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == \
+        [asset_3_local_id, None, None, asset_2_local_id, None]
+
+    # a malformed topio ID fails the whole request
+    response = client.post(
+        '/assets/custom_ids/resolve',
+        json=[asset_2_topio_id, 'topio.abc.file'])
+
+    assert response.status_code == 422
+
 
 def test_assets_list(postgresql: connection):
     client = _init_test_client(postgresql)
@@ -640,3 +1667,136 @@ def test_assets_list(postgresql: connection):
     assert tmp_res['asset_type'] == asset_type_2_id
     assert tmp_res['description'] is None
     assert tmp_res['topio_id'] == asset_3_topio_id
+
+    # streamed as newline-delimited JSON
+    response = client.get(
+        '/assets/',
+        json={'user_id': owner_id},
+        headers={'Accept': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+
+    streamed_results = \
+        [json.loads(line) for line in response.content.splitlines()]
+
+    assert streamed_results == sorted(results, key=lambda d: d['id'])
+
+    # paginated
+    response = client.get(
+        '/assets/', params={'limit': 2}, json={'user_id': owner_id})
+
+    assert response.status_code == 200
+
+    page_1 = json.loads(response.content)
+    next_page = response.headers['X-Next-Cursor']
+
+    assert [d['id'] for d in page_1] == \
+        sorted([asset_1_id, asset_2_id, asset_3_id])[:2]
+
+    response = client.get(
+        '/assets/',
+        params={'limit': 2, 'next': next_page},
+        json={'user_id': owner_id},
+        headers={'Accept': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+
+    page_2 = [json.loads(line) for line in response.content.splitlines()]
+
+    assert page_1 + page_2 == sorted(results, key=lambda d: d['id'])
+    # last page
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = client.get(
+        '/assets/',
+        params={'limit': 2, 'next': 'not a cursor'},
+        json={'user_id': owner_id})
+
+    assert response.status_code == 422
+
+    # projected to the requested fields
+    response = client.get(
+        '/assets/',
+        params={'fields': 'id,local_id'},
+        json={'user_id': owner_id})
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == [
+        {'id': d['id'], 'local_id': d['local_id']}
+        for d in sorted(results, key=lambda d: d['id'])]
+
+    response = client.get(
+        '/assets/',
+        params={'fields': 'owner_namespace', 'limit': 2},
+        json={'user_id': owner_id},
+        headers={'Accept': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.content.splitlines()] == \
+        [{'owner_namespace': owner_namespace}] * 2
+    assert 'X-Next-Cursor' in response.headers
+
+    response = client.get(
+        '/assets/',
+        params={'fields': 'id,password'},
+        json={'user_id': owner_id})
+
+    assert response.status_code == 422
+
+
+def test_cache_stats(postgresql: connection):
+    client = _init_test_client(postgresql)
+
+    # register asset owner
+    owner_name = 'User ABC'
+    owner_namespace = 'abc'
+    response = client.post(
+        '/users/register',
+        json={'name': owner_name, 'user_namespace': owner_namespace})
+    owner_id = json.loads(response.content)['id']
+
+    # register asset type
+    asset_type_id = 'file'
+    asset_type_description = 'Data assets provided as downloadable file'
+
+    client.post(
+        '/asset_types/register',
+        json={'id': asset_type_id, 'description': asset_type_description})
+
+    asset_local_id = 'hdfs://foo.bar.ttl'
+    response = client.post(
+        '/assets/register',
+        json={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_local_id})
+    asset_topio_id = json.loads(response.content)['topio_id']
+
+    # both resolutions are served from the caches filled on registration
+    response = client.get(
+        '/assets/topio_id',
+        params={
+            'owner_id': owner_id,
+            'asset_type': asset_type_id,
+            'local_id': asset_local_id})
+
+    assert json.loads(response.content) == asset_topio_id
+
+    response = client.get(
+        '/assets/custom_id',
+        json={'topio_id': asset_topio_id})
+
+    assert json.loads(response.content) == asset_local_id
+
+    response = client.get('/cache/stats')
+
+    assert response.status_code == 200
+
+    stats = json.loads(response.content)
+
+    assert stats['topio_id_cache']['size'] == 1
+    assert stats['topio_id_cache']['hits'] >= 1
+    assert stats['local_id_cache']['size'] == 1
+    assert stats['local_id_cache']['hits'] >= 1
+    assert stats['users_cache']['size'] == 1
@@ -0,0 +1,115 @@
+from ompid.cache import BloomFilter, LRUCache, NegativeLookupFilter, \
+    Snapshot, key_digest
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+
+    assert cache.get('a') == 1
+    assert cache.get('c') is None
+    assert cache.get('c', 3) == 3
+
+    # 'b' is the least recently used entry now and gets evicted
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    assert cache.stats() == {
+        'size': 2,
+        'maxsize': 2,
+        'hits': 3,
+        'misses': 2,
+        'evictions': 1,
+    }
+
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    assert 'a' not in cache
+
+    cache.put('a', 1)
+    cache.resize(1)
+
+    assert len(cache) == 1
+    assert cache.get('a') == 1
+    assert cache.evictions == 2
+
+    cache.clear()
+
+    assert len(cache) == 0
+
+
+def test_bloom_filter():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+
+    keys = [f'key {i}' for i in range(1000)]
+
+    for key in keys:
+        bloom_filter.add(key)
+
+    # no false negatives
+    assert all(key in bloom_filter for key in keys)
+
+    # false positive rate is roughly as configured
+    false_positives = sum(
+        f'other key {i}' in bloom_filter for i in range(10000))
+
+    assert false_positives < 300
+
+
+def test_negative_lookup_filter():
+    negative_lookup_filter = NegativeLookupFilter(capacity=10, error_rate=0.01)
+
+    # everything might exist until the filter was populated
+    assert negative_lookup_filter.might_contain('a')
+
+    negative_lookup_filter.add('a')
+    negative_lookup_filter.rebuild(['b'])
+
+    assert negative_lookup_filter.might_contain('b')
+    assert not negative_lookup_filter.might_contain('a')
+    assert negative_lookup_filter.definite_misses == 1
+
+    negative_lookup_filter.add('a')
+
+    assert negative_lookup_filter.might_contain('a')
+
+    # keys can be added by their digests alone
+    assert not negative_lookup_filter.might_contain('d')
+
+    negative_lookup_filter.add_digest(key_digest('d'))
+
+    assert negative_lookup_filter.might_contain('d')
+
+    negative_lookup_filter.invalidate()
+
+    assert negative_lookup_filter.might_contain('c')
+
+
+def test_snapshot():
+    loads = []
+
+    def load():
+        loads.append(len(loads))
+        return len(loads)
+
+    snapshot = Snapshot(max_age=3600)
+
+    assert snapshot.get(load) == 1
+    assert snapshot.get(load) == 1
+
+    snapshot.invalidate()
+
+    assert snapshot.version == 1
+    assert snapshot.get(load) == 2
+    assert snapshot.get(load) == 2
+
+    # copies older than max_age are rebuilt
+    snapshot.max_age = 0
+
+    assert snapshot.get(load) == 3
+    assert len(loads) == 3
@@ -0,0 +1,57 @@
+import asyncio
+
+from ompid.coalescer import WriteCoalescer
+
+
+def test_write_coalescer():
+    batches = []
+
+    def flush(items):
+        batches.append(items)
+        return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=3)
+
+    async def submit(item):
+        try:
+            return await coalescer.submit(item)
+        except ValueError as e:
+            return e
+
+    async def submit_all():
+        return await asyncio.gather(*[submit(i) for i in [1, 2, 3, -4, 5]])
+
+    results = asyncio.get_event_loop().run_until_complete(submit_all())
+
+    # the first batch is flushed once full, the second one after the window
+    assert batches == [[1, 2, 3], [-4, 5]]
+
+    assert results[:3] == [2, 4, 6]
+    assert isinstance(results[3], ValueError)
+    assert results[4] == 10
+
+    assert coalescer.stats() == {
+        'window': 0.01,
+        'max_batch_size': 3,
+        'batches': 2,
+        'items': 5,
+        'largest_batch': 3,
+        'mean_batch_size': 2.5,
+        'batch_sizes': {2: 1, 4: 1},
+    }
+
+
+def test_write_coalescer_flush_failure():
+    def flush(items):
+        raise RuntimeError('database unavailable')
+
+    coalescer = WriteCoalescer(flush, window=0.01, max_batch_size=10)
+
+    async def submit_all():
+        return await asyncio.gather(
+            coalescer.submit(1), coalescer.submit(2), return_exceptions=True)
+
+    results = asyncio.get_event_loop().run_until_complete(submit_all())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert coalescer.stats()['batches'] == 1
@@ -0,0 +1,89 @@
+import json
+import os
+
+from ompid.journal import WriteBehindJournal
+
+
+def test_write_behind_journal(tmp_path):
+    flushed = []
+
+    # a long flush interval, so records are only flushed on stop
+    journal = WriteBehindJournal(str(tmp_path), flushed.extend, 3600)
+    journal.start()
+
+    journal.append([{'id': 1}, {'id': 2}])
+    journal.append([{'id': 3}])
+
+    # appended records are on disk before they are flushed
+    assert flushed == []
+    assert len(os.listdir(tmp_path / '0')) == 1
+
+    journal.stop()
+
+    assert flushed == [{'id': 1}, {'id': 2}, {'id': 3}]
+    assert os.listdir(tmp_path / '0') == []
+
+
+def test_write_behind_journal_replay(tmp_path):
+    # segments left by a crashed process, the last record of which was torn
+    (tmp_path / '0').mkdir()
+    (tmp_path / '0' / f'{1:020d}.jsonl').write_text(
+        json.dumps({'id': 1}) + '\n' + json.dumps({'id': 2}) + '\n')
+    (tmp_path / '0' / f'{2:020d}.jsonl').write_text(
+        json.dumps({'id': 3}) + '\n{"id": ')
+
+    flushed = []
+
+    journal = WriteBehindJournal(str(tmp_path), flushed.extend, 3600)
+    journal.start()
+
+    assert flushed == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+    # a second process sharing the directory claims another slot
+    other_journal = WriteBehindJournal(str(tmp_path), flushed.extend, 3600)
+    other_journal.start()
+    other_journal.append([{'id': 4}])
+
+    assert os.listdir(tmp_path / '1') != []
+
+    other_journal.stop()
+    journal.stop()
+
+    assert flushed == [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}]
+
+
+def test_write_behind_journal_replay_unclaimed_slots(tmp_path):
+    flushed = []
+
+    # a running process...
+    running_journal = WriteBehindJournal(str(tmp_path), flushed.extend, 3600)
+    running_journal.start()
+    running_journal.append([{'id': 1}])
+
+    # ...and two processes which journaled records and crashed
+    for slot, record_id in [(1, 2), (2, 3)]:
+        (tmp_path / f'{slot}.lock').touch()
+        (tmp_path / str(slot)).mkdir()
+        (tmp_path / str(slot) / f'{1:020d}.jsonl').write_text(
+            json.dumps({'id': record_id}) + '\n')
+
+    # a single restarted process flushes the slots of both crashed processes
+    # but not the one of the running process
+    journal = WriteBehindJournal(str(tmp_path), flushed.extend, 3600)
+    journal.start()
+
+    assert sorted(record['id'] for record in flushed) == [2, 3]
+    assert len(os.listdir(tmp_path / '0')) == 1
+    assert os.listdir(tmp_path / '2') == []
+
+    # the lock of the flushed slot was released again
+    other_journal = WriteBehindJournal(str(tmp_path), flushed.extend, 3600)
+    other_journal.start()
+
+    assert other_journal._slot_directory == str(tmp_path / '2')
+
+    other_journal.stop()
+    journal.stop()
+    running_journal.stop()
+
+    assert sorted(record['id'] for record in flushed) == [1, 2, 3]
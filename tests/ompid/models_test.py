@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from ompid.models import TOPIO_ID_SCHEMA, TopioAssetORM, TopioUserORM, \
+    topio_id_to_candidate_parts, topio_id_to_parts
+
+
+def test_topio_id_to_parts():
+    topio_id = TOPIO_ID_SCHEMA.format(**{
+        'owner_namespace': 'abc',
+        'asset_id': 23,
+        'asset_type': 'file'})
+
+    assert topio_id_to_parts(topio_id) == (23, 'file', 'abc')
+
+    # namespaces and asset types may contain dots
+    topio_id = TOPIO_ID_SCHEMA.format(**{
+        'owner_namespace': 'abc.de',
+        'asset_id': 42,
+        'asset_type': 'file.ttl'})
+
+    assert topio_id_to_parts(topio_id) == (42, 'file.ttl', 'abc.de')
+    assert topio_id_to_candidate_parts(topio_id) == \
+        [(42, 'file.ttl', 'abc.de')]
+
+    # ...and even all-digit parts, which makes the split ambiguous
+    topio_id = TOPIO_ID_SCHEMA.format(**{
+        'owner_namespace': 'a.1.b',
+        'asset_id': 2,
+        'asset_type': 'file'})
+
+    assert topio_id_to_candidate_parts(topio_id) == [
+        (1, 'b.2.file', 'a'),
+        (2, 'file', 'a.1.b')]
+    assert topio_id_to_parts(topio_id) == (1, 'b.2.file', 'a')
+
+    for malformed_topio_id in [
+            '',
+            'topio.abc.file',
+            'topio.abc.x23.file',
+            'foo.abc.23.file',
+            'topio.abc.23.',
+            'topio.abc.23.file ']:
+
+        with pytest.raises(ValueError):
+            topio_id_to_parts(malformed_topio_id)
+
+        with pytest.raises(ValueError):
+            topio_id_to_candidate_parts(malformed_topio_id)
+
+
+def test_asset_owner_namespace_is_joined():
+    statement = str(
+        Query(TopioAssetORM).statement.compile(dialect=postgresql.dialect()))
+
+    # one join per query instead of a correlated subquery per asset row
+    assert 'JOIN topio_user' in statement
+    assert '(SELECT' not in statement
+
+    owner = TopioUserORM(id=1, name='User ABC', user_namespace='abc')
+    asset = TopioAssetORM(id=23, owner_id=1, asset_type='file', owner=owner)
+
+    assert asset.owner_namespace == 'abc'
+    assert TopioAssetORM(id=42).owner_namespace is None